@@ -1,7 +1,8 @@
 import jsonpickle
 import logging
+from LoggingSetup import configureLogging
 
-logging.basicConfig(level = logging.DEBUG, format = '%(asctime)s - %(levelname)s - %(message)s')
+configureLogging()
 LOGGER = logging.getLogger()
 
 
@@ -30,7 +31,7 @@ class CompanyLocations:
 
     def getQueryResultList(self):
         if self.queryResultList is None:
-            LOGGER.error("Query result list for", self.getCompanyName(), "is null!")
+            LOGGER.error("Query result list for %s is null!", self.getCompanyName())
             raise TypeError
 
         return self.queryResultList
@@ -62,6 +63,14 @@ class CompanyLocations:
         """
         return jsonpickle.encode(self, unpicklable = unpicklable)
 
+    def getLocationRecords(self):
+        """
+        Flattens this company's results into one record per query result (see getLocationRecords())
+
+        :rtype: [dict]
+        """
+        return getLocationRecords(self)
+
     def __eq__(self, other):
         """
         Equivalence check based on company name and its query result list
@@ -79,3 +88,39 @@ class CompanyLocations:
             return areCompanyNamesEqual and areQueryResultListsEqual
 
         return False
+
+
+def getLocationRecords(companyLocations):
+    """
+    Flattens a CompanyLocations object, or its JSON dictionary form, into one record per query result. This is the
+    columnar counterpart of the nested JSON schema, used by the location index and the Parquet writer.
+
+    :param companyLocations: Company whose results are to be flattened
+    :type companyLocations: CompanyLocations or dict
+
+    :return: List of records of form {companyName, companyKeyword, resultName, lat, lon, types, vicinity}
+    :rtype: [dict]
+    """
+    if isinstance(companyLocations, dict):
+        companyName = companyLocations.get("companyName")
+        queryResultList = companyLocations.get("queryResultList") or []
+    else:
+        companyName = companyLocations.getCompanyName()
+        queryResultList = companyLocations.getQueryResultList()
+
+    records = []
+    for queryResult in queryResultList:
+        if not isinstance(queryResult, dict):
+            queryResult = queryResult.getDictionaryRepresentation()
+
+        records.append({
+            "companyName": companyName,
+            "companyKeyword": queryResult.get("companyKeyword"),
+            "resultName": queryResult.get("resultName"),
+            "lat": float(queryResult["geometry"]["lat"]),
+            "lon": float(queryResult["geometry"]["lon"]),
+            "types": list(queryResult.get("types") or []),
+            "vicinity": queryResult.get("vicinity"),
+        })
+
+    return records
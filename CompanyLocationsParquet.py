@@ -0,0 +1,287 @@
+import os
+import shutil
+import logging
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from CompanyLocations import CompanyLocations, getLocationRecords
+from LoggingSetup import configureLogging
+
+configureLogging()
+LOGGER = logging.getLogger()
+
+"""
+Columnar output for CompanyLocations. The nested JSON schema (see example.py) is flattened into one row per query
+result:
+
+root
+ |-- companyName: string
+ |-- companyKeyword: string
+ |-- resultName: string
+ |-- lat: double
+ |-- lon: double
+ |-- types: list<string>
+ |-- vicinity: string
+ |-- state: string (only filled if the run was restricted to a state)
+
+and written to Parquet, optionally partitioned (hive-style, e.g. companyName=acme/part-0-0.parquet) by company or state.
+"""
+
+LOCATION_SCHEMA = pa.schema([
+    ("companyName", pa.string()),
+    ("companyKeyword", pa.string()),
+    ("resultName", pa.string()),
+    ("lat", pa.float64()),
+    ("lon", pa.float64()),
+    ("types", pa.list_(pa.string())),
+    ("vicinity", pa.string()),
+    ("state", pa.string()),
+])
+PARTITION_COLUMNS = ["companyName", "state"]
+# Partition values are always read back as strings, rather than inferred (e.g. a company named "3M" stays a string)
+PARTITIONING = ds.partitioning(pa.schema([(columnName, pa.string()) for columnName in PARTITION_COLUMNS]),
+                               flavor = "hive")
+DEFAULT_ROW_GROUP_SIZE = 10000
+
+
+class CompanyLocationsParquetWriter:
+    """
+    Buffers the results of CompanyLocations objects as they are added and writes them out as Arrow record batches once
+    the buffer reaches a row group's worth of rows, so a run never has to hold its whole output in memory.
+
+    Usage:
+        with CompanyLocationsParquetWriter("results", partitionBy = "companyName") as writer:
+            for companyLocations in companyLocationsMaster.values():
+                writer.addCompanyLocations(companyLocations)
+    """
+
+    def __init__(self, path, partitionBy = None, state = None, rowGroupSize = DEFAULT_ROW_GROUP_SIZE,
+                 overwrite = False):
+        """
+        :param path: Parquet file to be written or, if partitioned, the root directory of the dataset
+        :type path: str
+
+        :param partitionBy: Optional column to partition by, either "companyName" or "state"
+        :type partitionBy: str
+
+        :param state: State the run was restricted to (see parseCitiesCSV()), stored in the state column
+        :type state: str
+
+        :param rowGroupSize: Amount of rows buffered before a row group is written
+        :type rowGroupSize: int
+
+        :param overwrite: Whether an existing file or dataset at path is deleted. If not, it is refused, since new
+        partitions would otherwise be mixed with those of an earlier run
+        :type overwrite: bool
+        """
+        if path is None:
+            LOGGER.error("path is null")
+            raise TypeError
+
+        if partitionBy is not None and partitionBy not in PARTITION_COLUMNS:
+            LOGGER.error("Cannot partition by %s, must be one of %s", partitionBy, PARTITION_COLUMNS)
+            raise ValueError
+
+        if partitionBy == "state" and state is None:
+            LOGGER.error("Cannot partition by state, the run was not restricted to a state")
+            raise ValueError
+
+        if os.path.exists(path):
+            if not overwrite:
+                LOGGER.error("%s already exists, pass overwrite = True to replace it", path)
+                raise ValueError
+
+            LOGGER.info("Replacing %s", path)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+
+        self.path = path
+        self.partitionBy = partitionBy
+        self.state = state
+        self.rowGroupSize = rowGroupSize
+        self.columns = {field.name: [] for field in LOCATION_SCHEMA}
+        self.amountOfBufferedRows = 0
+        self.amountOfWrittenRows = 0
+        self.amountOfFlushes = 0
+        self.parquetWriter = None
+
+    def addCompanyLocations(self, companyLocations):
+        """
+        :param companyLocations: Company whose results are to be written
+        :type companyLocations: CompanyLocations
+        """
+        if companyLocations is None:
+            LOGGER.error("addCompanyLocations failed because company locations are null.")
+            raise TypeError
+
+        for record in getLocationRecords(companyLocations):
+            for columnName in self.columns:
+                self.columns[columnName].append(record.get(columnName, self.state))
+            self.amountOfBufferedRows += 1
+
+        if self.amountOfBufferedRows >= self.rowGroupSize:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes whatever is buffered as one row group (one file per partition if partitioned)
+        """
+        if self.amountOfBufferedRows == 0:
+            return
+
+        table = pa.Table.from_batches([pa.RecordBatch.from_pydict(self.columns, schema = LOCATION_SCHEMA)])
+
+        if self.partitionBy is None:
+            if self.parquetWriter is None:
+                self.parquetWriter = pq.ParquetWriter(self.path, LOCATION_SCHEMA)
+            self.parquetWriter.write_table(table, row_group_size = self.rowGroupSize)
+        else:
+            ds.write_dataset(table, self.path, format = "parquet", partitioning = [self.partitionBy],
+                             partitioning_flavor = "hive",
+                             basename_template = "part-" + str(self.amountOfFlushes) + "-{i}.parquet",
+                             existing_data_behavior = "overwrite_or_ignore")
+
+        LOGGER.debug("Wrote %d rows to %s", self.amountOfBufferedRows, self.path)
+        self.amountOfWrittenRows += self.amountOfBufferedRows
+        self.amountOfFlushes += 1
+        self.columns = {field.name: [] for field in LOCATION_SCHEMA}
+        self.amountOfBufferedRows = 0
+
+    def close(self):
+        self.flush()
+
+        if self.parquetWriter is not None:
+            self.parquetWriter.close()
+            self.parquetWriter = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exceptionType, exceptionValue, traceback):
+        self.close()
+
+
+def writeCompanyLocationsParquet(companyLocationsMaster, path, partitionBy = None, state = None,
+                                 rowGroupSize = DEFAULT_ROW_GROUP_SIZE, overwrite = False):
+    """
+    Writes the output of getCompanyLocationsNearLocationList() to Parquet (see CompanyLocationsParquetWriter)
+
+    :param companyLocationsMaster: Dictionary (or iterable) of company locations
+    :type companyLocationsMaster: {str : CompanyLocations}
+
+    :param path: Parquet file to be written or, if partitioned, the root directory of the dataset
+    :type path: str
+
+    :param partitionBy: Optional column to partition by, either "companyName" or "state"
+    :type partitionBy: str
+
+    :param state: State the run was restricted to, stored in the state column
+    :type state: str
+
+    :param rowGroupSize: Amount of rows per row group
+    :type rowGroupSize: int
+
+    :param overwrite: Whether an existing file or dataset at path is replaced (otherwise it is refused)
+    :type overwrite: bool
+
+    :return: Amount of rows written
+    :rtype: int
+    """
+    if isinstance(companyLocationsMaster, dict):
+        companyLocationsMaster = companyLocationsMaster.values()
+
+    with CompanyLocationsParquetWriter(path, partitionBy = partitionBy, state = state, rowGroupSize = rowGroupSize,
+                                       overwrite = overwrite) as writer:
+        for companyLocations in companyLocationsMaster:
+            writer.addCompanyLocations(companyLocations)
+
+    return writer.amountOfWrittenRows
+
+
+def readCompanyLocationsParquet(path, companyNames = None):
+    """
+    Reads a file or dataset written by CompanyLocationsParquetWriter back into CompanyLocations objects. Query results
+    are restored to the same dictionary form QueryResult.getDictionaryRepresentation() produces.
+
+    Only results are stored, one row each, under CompanyLocations.companyName (i.e. without the double-quotes of the
+    keywords the pipelines key their output by). Without companyNames, the dictionary returned is therefore keyed by
+    unquoted name and has no entry for companies without results. Passing the pipeline's own company name list gives
+    back the same keys, with an empty CompanyLocations object for every company that had no results.
+
+    :param path: Parquet file or root directory of a partitioned dataset
+    :type path: str
+
+    :param companyNames: Optional list of companies to be read (quoted or not); other rows are skipped while scanning
+    :type companyNames: [str]
+
+    :return: Dictionary of company locations
+    :rtype: {str : CompanyLocations}
+    """
+    if path is None:
+        LOGGER.error("path is null")
+        raise TypeError
+
+    partitioning = PARTITIONING if os.path.isdir(path) else None
+    dataset = ds.dataset(path, format = "parquet", partitioning = partitioning)
+    rowFilter = None
+    companyLocationsMaster = {}
+    companyKeys = {}  # Stored (unquoted) name to the key it is returned under
+
+    if companyNames is not None:
+        for companyKey in companyNames:
+            companyName = companyKey.replace('"', '')
+            companyKeys[companyName] = companyKey
+            companyLocationsMaster[companyKey] = CompanyLocations(companyName = companyName)
+        rowFilter = ds.field("companyName").isin(list(companyKeys))
+
+    for batch in dataset.to_batches(filter = rowFilter):
+        columns = batch.to_pydict()
+
+        for rowIndex, companyName in enumerate(columns["companyName"]):
+            companyKey = companyKeys.get(companyName, companyName)
+            if companyKey not in companyLocationsMaster:
+                companyLocationsMaster[companyKey] = CompanyLocations(companyName = companyName)
+
+            companyLocationsMaster[companyKey].getQueryResultList().append({
+                "resultName": columns["resultName"][rowIndex],
+                "types": columns["types"][rowIndex] or [],
+                "geometry": {
+                    "lat": columns["lat"][rowIndex],
+                    "lon": columns["lon"][rowIndex],
+                },
+                "companyKeyword": columns["companyKeyword"][rowIndex],
+                "vicinity": columns["vicinity"][rowIndex],
+            })
+
+    return companyLocationsMaster
+
+
+if __name__ == "__main__":
+    # Round-trip check: what a pipeline returns should be read back unchanged, for every layout
+    import tempfile
+    from QueryResult import QueryResult
+
+    sampleCompanyLocations = {'"Acme Cement"': CompanyLocations(companyName = "Acme Cement"),
+                              '"123"': CompanyLocations(companyName = "123"),
+                              '"No Results Inc"': CompanyLocations(companyName = "No Results Inc")}
+    for resultIndex in range(3):
+        for companyKey in ['"Acme Cement"', '"123"']:
+            sampleCompanyLocations[companyKey].addQueryResult(QueryResult(
+                resultName = companyKey.replace('"', '').lower(), types = ["establishment"],
+                latitude = 40.0 + resultIndex, longitude = -74.0, companyKeyword = companyKey.replace('"', ''),
+                vicinity = str(resultIndex) + " Main St"))
+
+    with tempfile.TemporaryDirectory() as temporaryDirectory:
+        for partitionBy in [None, "companyName", "state"]:
+            outputPath = os.path.join(temporaryDirectory, str(partitionBy))
+            writeCompanyLocationsParquet(sampleCompanyLocations, outputPath, partitionBy = partitionBy,
+                                         state = "New Jersey", rowGroupSize = 2)
+            readBack = readCompanyLocationsParquet(outputPath, companyNames = list(sampleCompanyLocations))
+            assert readBack == sampleCompanyLocations, partitionBy
+
+            readBackUnquoted = readCompanyLocationsParquet(outputPath)
+            assert sorted(readBackUnquoted) == ["123", "Acme Cement"], partitionBy
+
+    print("Parquet round trip OK")
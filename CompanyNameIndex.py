@@ -0,0 +1,211 @@
+import re
+import math
+import logging
+from collections import defaultdict, Counter
+from FuzzyStringFilter import fuzzyStringFilterMatch, fuzzyStringFilterScore, FilterType
+from LoggingSetup import configureLogging
+
+configureLogging()
+LOGGER = logging.getLogger()
+
+NGRAM_LENGTH = 3
+# Words that say nothing about which company a place belongs to
+LEGAL_SUFFIXES = {"inc", "incorporated", "co", "corp", "corporation", "company", "companies", "llc", "llp", "lp",
+                  "ltd", "limited", "plc", "sa", "ag", "nv", "the", "and", "of"}
+
+
+def cleanCompanyName(name):
+    """
+    Lower-cases a name and strips the double-quotes added for the API as well as any punctuation
+
+    :rtype: str
+    """
+    return " ".join(re.sub(r"[^\w\s]", " ", name.replace('"', '').lower()).split())
+
+
+def getDistinctiveName(cleanName, ignoredWords = frozenset()):
+    """
+    Strips legal suffixes and ignored words (e.g. the sweep keywords, which every place returned by a sweep is likely to
+    contain) from a cleaned name. A company name made of nothing else keeps its words other than legal suffixes or, if
+    there are none, all of them.
+
+    :rtype: str
+    """
+    words = cleanName.split()
+    for droppedWords in (LEGAL_SUFFIXES | ignoredWords, LEGAL_SUFFIXES):
+        distinctiveWords = [word for word in words if word not in droppedWords]
+        if distinctiveWords:
+            return " ".join(distinctiveWords)
+
+    return cleanName
+
+
+def getNGrams(cleanName, ngramLength = NGRAM_LENGTH):
+    """
+    Character n-grams of every word of a cleaned name, padded so that short words and word boundaries count too
+
+    :rtype: set
+    """
+    ngrams = set()
+    for word in cleanName.split():
+        paddedWord = " " + word + " "
+        for startIndex in range(max(1, len(paddedWord) - ngramLength + 1)):
+            ngrams.add(paddedWord[startIndex:startIndex + ngramLength])
+
+    return ngrams
+
+
+class CompanyNameIndex:
+    """
+    Inverted index from character n-grams to the companies whose distinctive names (see getDistinctiveName()) contain
+    them. A place name is matched against every company at once. Distinctive names are only used to shortlist and rank
+    candidates: the index shortlists the companies sharing the most (rarest) n-grams with the place, and keeps those
+    whose distinctive words contain, or are contained in, the place's (e.g. "US Lime" for "US Lime & Minerals Inc", but
+    not "Newark Concrete" for "US Concrete Inc"). Whether a candidate matches is then decided by the fuzzy string filter
+    on the full cleaned names, as in placesNearbyQuery(), so "Summit Cement" does not match "Summit Materials Inc" even
+    though both come down to "summit". The place goes to the best-scoring candidate only.
+
+    Unlike a per-company search, a sweep returns every business of a sector, so competitors sharing sector words or
+    legal suffixes with a company (e.g. "Tilcon Materials Inc" and "Eagle Materials Inc") must not match.
+    """
+
+    def __init__(self, companyNameList, filterType = FilterType.LEVENSHTEIN_RATIO, threshold = 90.0,
+                 ignoredWords = None, maxCandidates = 10, maxPostingsFraction = 0.2):
+        """
+        :param companyNameList: Company names as returned by getListOfCompanyNames() (i.e. double-quoted)
+        :type companyNameList: [str]
+
+        :param filterType: Fuzzy string filter used to verify candidates
+        :type filterType: FilterType
+
+        :param threshold: Threshold of the fuzzy string filter
+        :type threshold: float
+
+        :param ignoredWords: Words stripped from company and place names before shortlisting, e.g. the sweep keywords
+        :type ignoredWords: [str]
+
+        :param maxCandidates: Amount of shortlisted companies verified per place name
+        :type maxCandidates: int
+
+        :param maxPostingsFraction: N-grams shared by more than this fraction of companies (e.g. " in", "co ") are not
+        used to shortlist, unless there are fewer than 50 companies
+        :type maxPostingsFraction: float
+        """
+        if companyNameList is None:
+            LOGGER.error("Company name list is null")
+            raise TypeError
+
+        self.filterType = filterType
+        self.threshold = threshold
+        self.ignoredWords = frozenset(word for ignoredWord in ignoredWords or []
+                                      for word in cleanCompanyName(ignoredWord).split())
+        self.maxCandidates = maxCandidates
+        self.companyNames = []
+        self.cleanNames = []
+        self.distinctiveNames = []
+        self.postings = defaultdict(list)
+
+        for companyName in dict.fromkeys(companyNameList):
+            companyIndex = len(self.companyNames)
+            self.companyNames.append(companyName)
+            self.cleanNames.append(cleanCompanyName(companyName))
+            self.distinctiveNames.append(getDistinctiveName(self.cleanNames[companyIndex], self.ignoredWords))
+            for ngram in getNGrams(self.distinctiveNames[companyIndex]):
+                self.postings[ngram].append(companyIndex)
+
+        amountOfCompanies = max(1, len(self.companyNames))
+        maxPostings = amountOfCompanies if amountOfCompanies < 50 else maxPostingsFraction * amountOfCompanies
+        self.ngramWeights = {ngram: math.log(1.0 + amountOfCompanies / len(companyIndices))
+                             for ngram, companyIndices in self.postings.items() if len(companyIndices) <= maxPostings}
+
+        LOGGER.debug("Company name index built with %d companies and %d n-grams", len(self.companyNames),
+                     len(self.ngramWeights))
+
+    def __len__(self):
+        return len(self.companyNames)
+
+    def getCandidates(self, distinctivePlaceName):
+        """
+        :param distinctivePlaceName: Name of a place returned by the API, cleaned and stripped (see match())
+        :type distinctivePlaceName: str
+
+        :return: Indices of the companies sharing the most n-gram weight with the place name, whose distinctive words
+        contain or are contained in the place's, best first
+        :rtype: [int]
+        """
+        scores = Counter()
+        for ngram in getNGrams(distinctivePlaceName):
+            weight = self.ngramWeights.get(ngram)
+            if weight is None:
+                continue
+            for companyIndex in self.postings[ngram]:
+                scores[companyIndex] += weight
+
+        placeWords = set(distinctivePlaceName.split())
+        candidates = []
+        for companyIndex, _ in scores.most_common(self.maxCandidates):
+            companyWords = set(self.distinctiveNames[companyIndex].split())
+            if companyWords <= placeWords or placeWords <= companyWords:
+                candidates.append(companyIndex)
+
+        return candidates
+
+    def match(self, placeName):
+        """
+        :param placeName: Name of a place returned by the API
+        :type placeName: str
+
+        :return: The company (as passed in, i.e. double-quoted) the place belongs to, or None
+        :rtype: str
+        """
+        cleanPlaceName = cleanCompanyName(placeName)
+        distinctivePlaceName = " ".join(word for word in cleanPlaceName.split()
+                                        if word not in LEGAL_SUFFIXES and word not in self.ignoredWords)
+        if not distinctivePlaceName:
+            return None
+
+        bestCompanyIndex = None
+        bestScore = None
+        for companyIndex in self.getCandidates(distinctivePlaceName):
+            cleanName = self.cleanNames[companyIndex]
+            if not fuzzyStringFilterMatch(cleanName, cleanPlaceName, self.filterType, self.threshold):
+                continue
+
+            # Ties go to the closer distinctive name, then to the more specific one, e.g. "summit materials holdings"
+            # over "summit materials"
+            distinctiveName = self.distinctiveNames[companyIndex]
+            score = (fuzzyStringFilterScore(cleanName, cleanPlaceName, self.filterType),
+                     fuzzyStringFilterScore(distinctiveName, distinctivePlaceName, self.filterType),
+                     len(distinctiveName.split()))
+            if bestScore is None or score > bestScore:
+                bestCompanyIndex = companyIndex
+                bestScore = score
+
+        if bestCompanyIndex is None:
+            return None
+
+        return self.companyNames[bestCompanyIndex]
+
+
+if __name__ == "__main__":
+    # Sweep for the Materials sector, matched the way getCompanyLocationsBySweep() does
+    companyNameIndex = CompanyNameIndex(['"Summit Materials Inc"', '"Eagle Materials Inc"', '"US Lime & Minerals Inc"',
+                                         '"US Concrete Inc"', '"Vulcan Materials Co"', '"Martin Marietta Materials"'],
+                                        filterType = FilterType.TOKEN_SET_RATIO, threshold = 80,
+                                        ignoredWords = ["materials", "quarry", "cement"])
+    expectedMatches = {"Summit Cement": None,
+                       "Eagle Cement Corp": None,
+                       "Eagle Rock Quarry": None,
+                       "Tilcon Materials Inc": None,
+                       "Newark Concrete Inc": None,
+                       "Materials Co": None,
+                       "US Lime & Minerals": '"US Lime & Minerals Inc"',
+                       "US Lime": '"US Lime & Minerals Inc"',
+                       "Vulcan Materials Company - Sanders Quarry": '"Vulcan Materials Co"',
+                       "Eagle Materials": '"Eagle Materials Inc"'}
+
+    for placeName, expectedCompanyName in expectedMatches.items():
+        companyName = companyNameIndex.match(placeName)
+        assert companyName == expectedCompanyName, (placeName, companyName, expectedCompanyName)
+
+    print("Matched %d place names as expected" % len(expectedMatches))
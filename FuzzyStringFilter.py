@@ -36,11 +36,31 @@ def fuzzyStringFilterMatch(companyName, resultName, filterType = FilterType.LEVE
     :rtype bool
     """
 
+    return fuzzyStringFilterScore(companyName, resultName, filterType) > threshold
+
+
+def fuzzyStringFilterScore(companyName, resultName, filterType = FilterType.LEVENSHTEIN_RATIO):
+    """
+    Similarity (0 to 100) of a query result's name to the company's name, as measured by the filter type that
+    fuzzyStringFilterMatch() compares to its threshold. Used to rank several companies a result could belong to.
+
+    :param companyName: The company name used to query Google Places API
+    :type companyName: str
+
+    :param resultName: The name of the result from the query
+    :type resultName: str
+
+    :param filterType: The type of comparison algorithm to be applied
+    :type filterType: FilterType
+
+    :rtype int
+    """
+
     if filterType == FilterType.LEVENSHTEIN_RATIO:
-        return fuzz.ratio(companyName, resultName) > threshold
+        return fuzz.ratio(companyName, resultName)
     elif filterType == FilterType.SUB_STRING_RATIO:
-        return fuzz.partial_ratio(companyName, resultName) > threshold
+        return fuzz.partial_ratio(companyName, resultName)
     elif filterType == FilterType.TOKEN_SORT_RATIO:
-        return fuzz.token_sort_ratio(companyName, resultName) > threshold
+        return fuzz.token_sort_ratio(companyName, resultName)
     else:
-        return fuzz.token_set_ratio(companyName, resultName) > threshold
+        return fuzz.token_set_ratio(companyName, resultName)
@@ -1,8 +1,18 @@
+import time
 import logging
 import googlemaps
+from collections import Counter
+from itertools import islice
 from QueryResult import QueryResult
 from CompanyLocations import CompanyLocations
+from QueryScheduler import QueryScheduler, EpicentreOrder
+from RunPlanner import getEmptyQueryStatistics
+from LatencyGuard import LatencyGuard, CircuitBreaker, CircuitOpenError
+from SingleFlight import SingleFlight
+from TypeClassifier import TypeClassifier
+from CompanyNameIndex import CompanyNameIndex
 from FuzzyStringFilter import fuzzyStringFilterMatch, FilterType
+from LoggingSetup import configureLogging
 
 # NOTE: GOOGLE PLACES API KEY REQUIRED HERE!
 API_KEY = 'SOME API KEY'
@@ -24,7 +34,7 @@ GOOGLE_PLACES_IRRELEVANT_TYPES = ['amusement_park', 'aquarium', 'art_gallery', '
                                   'natural_feature', 'university', 'parking', 'neighborhood', 'political',
                                   'general_contractor', 'gas_station', 'accounting', 'food', 'transit_station', "atm",
                                   'finance']
-logging.basicConfig(level = logging.DEBUG, format = '%(asctime)s - %(levelname)s - %(message)s')
+configureLogging()
 LOGGER = logging.getLogger()
 RADIUS_OF_SEARCH = 50000  # metres
 LOGGER.info("Starting...")
@@ -32,12 +42,54 @@ LOGGER.info("API acquired...")
 FUZZY_FILTER_TYPE = FilterType.TOKEN_SET_RATIO
 FUZZY_FILTER_THRESHOLD = 80
 FIELDS = ['geometry', 'name', 'type', 'permanently_closed', 'vicinity']  # Define the fields we want sent back to us
-GMAPS = googlemaps.Client(key = API_KEY)  # Define our client
+# Per-sector and per-company type rules (see TypeClassifier.py). Without a rule file, every company is filtered with
+# GOOGLE_PLACES_IRRELEVANT_TYPES as a deny list
+TYPE_RULES_FILE = None
+if TYPE_RULES_FILE:
+    TYPE_CLASSIFIER = TypeClassifier.fromJSONFile(TYPE_RULES_FILE, defaultDenyTypes = GOOGLE_PLACES_IRRELEVANT_TYPES)
+else:
+    TYPE_CLASSIFIER = TypeClassifier(defaultDenyTypes = GOOGLE_PLACES_IRRELEVANT_TYPES)
+TYPE_REJECTIONS = Counter()  # Amount of results rejected, per reason
+QUERY_STATISTICS = getEmptyQueryStatistics()  # Call counts and latencies, used by RunPlanner to estimate future runs
+
+# Deadlines, hedging and load shedding for API calls (see LatencyGuard.py). Both calls hit the same backend, so they
+# share a circuit breaker. Only detail lookups are idempotent enough to be hedged.
+NEARBY_DEADLINE = 10.0  # seconds
+DETAILS_DEADLINE = 5.0  # seconds
+MAX_REQUEUE_ROUNDS = 3  # How many times failed (company, city) pairs are retried at the end of a run
+REQUEUE_BACKOFF = 5.0  # seconds before the first retry round, doubled every round
+# API errors worth retrying. Others (e.g. INVALID_REQUEST, REQUEST_DENIED) fail the same way every time
+RETRIABLE_API_STATUSES = {"UNKNOWN_ERROR", "OVER_QUERY_LIMIT"}
+# Only errors worth retrying say the backend is in trouble, so only those count against the circuit breaker
+# (isRetriableError() is defined further down, hence the lambda)
+CIRCUIT_BREAKER = CircuitBreaker()
+NEARBY_GUARD = LatencyGuard("places_nearby", deadlineSeconds = NEARBY_DEADLINE, circuitBreaker = CIRCUIT_BREAKER,
+                            isFailure = lambda error: isRetriableError(error))
+DETAILS_GUARD = LatencyGuard("place", deadlineSeconds = DETAILS_DEADLINE, isIdempotent = True,
+                             circuitBreaker = CIRCUIT_BREAKER, isFailure = lambda error: isRetriableError(error))
+
+# Requests abandoned by a guard keep running on its thread pool until the client gives up on them, so the client needs
+# a timeout of its own, no shorter than the deadlines above
+CLIENT_TIMEOUT = max(NEARBY_DEADLINE, DETAILS_DEADLINE)  # seconds, per HTTP request
+CLIENT_RETRY_TIMEOUT = 3 * CLIENT_TIMEOUT  # seconds, across the client's own retries
+GMAPS = googlemaps.Client(key = API_KEY, timeout = CLIENT_TIMEOUT, retry_timeout = CLIENT_RETRY_TIMEOUT)
 LOGGER.info("Client defined...")
 
+# Identical requests in flight at the same time are only sent once (see SingleFlight.py). Requests are compared after
+# canonicalization: coordinates rounded to COORDINATE_PRECISION decimals (about a metre), keywords lower-cased with
+# whitespace collapsed, and fields sorted.
+COORDINATE_PRECISION = 5
+
+# Sweep mode (see getCompanyLocationsBySweep()). places_nearby() returns at most 3 pages of 20 results, and a page token
+# only becomes valid a couple of seconds after the page that contained it was returned.
+MAX_PAGES_PER_SWEEP = 3
+PAGE_TOKEN_DELAY = 2.0  # seconds
+NEARBY_FLIGHTS = SingleFlight("places_nearby")
+DETAILS_FLIGHTS = SingleFlight("place")
+
 
 def placesNearbyQuery(companyLocations, locationEpicentre, radiusFromEpicentre = 100, hasToBeOpen = False,
-                      companyKeyword = "", coordinates = {}):
+                      companyKeyword = "", coordinates = {}, sector = None):
     """
     For a company keyword (i.e. their official name), performs a search using Google Places' API around a location. This
     location is a set of coordinates in string form, and the radius of search is maxed out at 50,000 metres. Provided
@@ -63,71 +115,177 @@ def placesNearbyQuery(companyLocations, locationEpicentre, radiusFromEpicentre =
     :param coordinates: Dictionary to keep track of already-seen coordinates
     :type coordinates: {str : [(float, float]}
 
+    :param sector: Sector of the run, selects the type rules of companies not listed in the rule file (see
+    TypeClassifier.getRuleSet())
+    :type sector: str
+
     :return: None
     """
 
     # Define our search
-    placesResult = GMAPS.places_nearby(location = locationEpicentre,
-                                       radius = radiusFromEpicentre,
-                                       open_now = hasToBeOpen,
-                                       keyword = companyKeyword)
+    nearbyRequest = getCanonicalNearbyRequest(location = locationEpicentre,
+                                              radius = radiusFromEpicentre,
+                                              open_now = hasToBeOpen,
+                                              keyword = companyKeyword)
+    placesResult = getNearbyPlaces(nearbyRequest)
 
     # If query fails
     if placesResult["status"] != "OK":
-        LOGGER.warning("Error geocoding {}: {}".format(companyKeyword, placesResult["status"]))
+        LOGGER.warning("Error geocoding %s: %s", companyKeyword, placesResult["status"])
         return
 
+    QUERY_STATISTICS["nearbyResults"] += len(placesResult['results'])
+
     if len(placesResult['results']) > 0:
+        # Nearby results already carry their types, so irrelevant places can be dropped before paying for details
+        areTypesAccepted, typeReasons = TYPE_CLASSIFIER.classifyBatch([place.get('types', [])
+                                                                        for place in placesResult['results']],
+                                                                       companyName = companyKeyword, sector = sector)
+
         # Loop through each place in results:
-        for place in placesResult['results']:
+        for place, isTypeAccepted, typeReason in zip(placesResult['results'], areTypesAccepted, typeReasons):
             # Define my place id
             placeID = place['place_id']
 
             if not fuzzyStringFilterMatch(companyKeyword, place['name'], FUZZY_FILTER_TYPE, FUZZY_FILTER_THRESHOLD):
-                LOGGER.info("Fuzzy string non-match {}: {}".format(companyKeyword, place['name']))
-                return
+                LOGGER.debug("Fuzzy string non-match %s: %s", companyKeyword, place['name'])
+                continue
+
+            if not isTypeAccepted:
+                TYPE_REJECTIONS[typeReason] += 1
+                LOGGER.debug("Type rejection %s: %s (%s)", companyKeyword, place['name'], typeReason)
+                continue
 
             # Make a request for the details
-            placeInformation = GMAPS.place(place_id = placeID, fields = FIELDS)
+            placeInformation = getPlaceDetails(placeID)
 
             if placeInformation['status'] != "OK":
-                LOGGER.warning("Error extracting details of {}: {}".format(companyKeyword, placesResult["status"]))
+                LOGGER.warning("Error extracting details of %s: %s", companyKeyword, placeInformation["status"])
                 LOGGER.warning("Skipping!")
                 continue
 
-            # Extract relevant information from JSON
-            placeName = placeInformation['result']['name'].strip().lower()
-            placeTypes = placeInformation['result']['types']
-            placeLatitude = float(placeInformation['result']['geometry']['location']['lat'])
-            placeLongitude = float(placeInformation['result']['geometry']['location']['lng'])
-            if 'vicinity' in placeInformation['result']:
-                placeVicinity = placeInformation['result']['vicinity']
-            else:
-                placeVicinity = "N/A"
-            # Is this business permanently closed? If so, we want to filter that out
-            permanentlyClosed = getIsPermanentlyClosed(placeInformation = placeInformation)
-
-            if permanentlyClosed is False and set(placeTypes).isdisjoint(GOOGLE_PLACES_IRRELEVANT_TYPES):
-                # If this location is not categorised as any of our 'irrelevant' types
-                newQueryResult = QueryResult(resultName= placeName,
-                                             types = placeTypes,
-                                             latitude = placeLatitude,
-                                             longitude = placeLongitude,
-                                             companyKeyword = companyKeyword.replace('"', ''),
-                                             vicinity = placeVicinity)
-
-                print(coordinates)
-                if (newQueryResult.getLatitude(), newQueryResult.getLongitude()) not \
-                        in coordinates[companyKeyword]:
-                    # If this set of coordinates has been not seen before
-                    companyLocations.addQueryResult(newQueryResult)
-                    coordinates[companyKeyword].append((newQueryResult.getLatitude(), newQueryResult.getLongitude()))
-
-
-def getCompanyLocationsNearLocationList(companyNameList, locationsDictionary, limitOfAmountOfCities = 50):
+            addPlaceToCompanyLocations(companyLocations = companyLocations, companyKeyword = companyKeyword,
+                                       placeInformation = placeInformation, coordinates = coordinates, sector = sector)
+
+
+def getNearbyPlaces(nearbyRequest):
+    """
+    Sends a nearby search, through the single-flight group and latency guard for nearby calls
+
+    :param nearbyRequest: Arguments of the search, as returned by getCanonicalNearbyRequest()
+    :type nearbyRequest: dict
+
+    :return: Response from Google Places API
+    :rtype: JSON
+    """
+    startTime = time.perf_counter()
+    isSent = True
+    try:
+        return NEARBY_FLIGHTS.call(getRequestKey(nearbyRequest), NEARBY_GUARD.call, GMAPS.places_nearby,
+                                   **nearbyRequest)
+    except CircuitOpenError:
+        isSent = False
+        raise
+    finally:
+        # Failed requests are billed too, only calls refused by the circuit breaker are not
+        if isSent:
+            QUERY_STATISTICS["nearbyCalls"] += 1
+            QUERY_STATISTICS["nearbySeconds"] += time.perf_counter() - startTime
+
+
+def getPlaceDetails(placeID):
+    """
+    Requests the details (FIELDS) of a place, through the single-flight group and latency guard for detail calls
+
+    :param placeID: Google Places ID of the place
+    :type placeID: str
+
+    :return: Response from Google Places API
+    :rtype: JSON
+    """
+    startTime = time.perf_counter()
+    detailsRequest = getCanonicalDetailsRequest(place_id = placeID, fields = FIELDS)
+    isSent = True
+    try:
+        return DETAILS_FLIGHTS.call(getRequestKey(detailsRequest), DETAILS_GUARD.call, GMAPS.place, **detailsRequest)
+    except CircuitOpenError:
+        isSent = False
+        raise
+    finally:
+        # Failed and hedged requests are billed too, only calls refused by the circuit breaker are not
+        if isSent:
+            QUERY_STATISTICS["detailCalls"] += 1
+            QUERY_STATISTICS["detailHedges"] = DETAILS_GUARD.getCounters()["hedges"]
+            QUERY_STATISTICS["detailSeconds"] += time.perf_counter() - startTime
+
+
+def addPlaceToCompanyLocations(companyLocations, companyKeyword, placeInformation, coordinates, sector = None):
+    """
+    Adds a place to a company's locations, unless it is permanently closed, rejected by the type classifier, or its
+    coordinates have already been seen for this company.
+
+    :param companyLocations: Company locations collected thus far for this company
+    :type companyLocations: CompanyLocations
+
+    :param companyKeyword: The actual name of the company, as queried into Google Places API
+    :type companyKeyword: str
+
+    :param placeInformation: Details response from Google Places API (see getPlaceDetails())
+    :type placeInformation: JSON
+
+    :param coordinates: Dictionary to keep track of already-seen coordinates
+    :type coordinates: {str : [(float, float]}
+
+    :param sector: Sector of the run, selects the type rules of companies not listed in the rule file (see
+    TypeClassifier.getRuleSet())
+    :type sector: str
+
+    :return: Whether the place was added
+    :rtype: bool
+    """
+    # Extract relevant information from JSON
+    placeName = placeInformation['result']['name'].strip().lower()
+    placeTypes = placeInformation['result']['types']
+    placeLatitude = float(placeInformation['result']['geometry']['location']['lat'])
+    placeLongitude = float(placeInformation['result']['geometry']['location']['lng'])
+    if 'vicinity' in placeInformation['result']:
+        placeVicinity = placeInformation['result']['vicinity']
+    else:
+        placeVicinity = "N/A"
+    # Is this business permanently closed? If so, we want to filter that out
+    permanentlyClosed = getIsPermanentlyClosed(placeInformation = placeInformation)
+
+    isTypeAccepted, typeReason = TYPE_CLASSIFIER.classify(placeTypes, companyName = companyKeyword, sector = sector)
+    if not isTypeAccepted:
+        TYPE_REJECTIONS[typeReason] += 1
+        LOGGER.debug("Type rejection %s: %s (%s)", companyKeyword, placeName, typeReason)
+
+    if permanentlyClosed is False and isTypeAccepted:
+        # If this location is not categorised as any of our 'irrelevant' types
+        newQueryResult = QueryResult(resultName= placeName,
+                                     types = placeTypes,
+                                     latitude = placeLatitude,
+                                     longitude = placeLongitude,
+                                     companyKeyword = companyKeyword.replace('"', ''),
+                                     vicinity = placeVicinity)
+
+        if (newQueryResult.getLatitude(), newQueryResult.getLongitude()) not \
+                in coordinates[companyKeyword]:
+            # If this set of coordinates has been not seen before
+            companyLocations.addQueryResult(newQueryResult)
+            QUERY_STATISTICS["acceptedResults"] += 1
+            coordinates[companyKeyword].append((newQueryResult.getLatitude(), newQueryResult.getLongitude()))
+            return True
+
+    return False
+
+
+def getCompanyLocationsNearLocationList(companyNameList, locationsDictionary, limitOfAmountOfCities = 50,
+                                        profiler = None, sector = None):
     """
     Generates a dictionary of CompanyLocations objects based on a set of company names and their respective coordinates.
-    One can limit the amount of cities to be searched.
+    One can limit the amount of cities to be searched (the first limitOfAmountOfCities cities are searched, or every
+    city if it is None).
 
     :param companyNameList: A list of names of companies to be search
     :type companyNameList: [str]
@@ -138,15 +296,22 @@ def getCompanyLocationsNearLocationList(companyNameList, locationsDictionary, li
     :param limitOfAmountOfCities: Optional limit of amount of cities to be searched
     :type limitOfAmountOfCities: int
 
+    :param profiler: Optional profiler, a stage boundary is marked after every city
+    :type profiler: RunProfiler
+
+    :param sector: Sector of the run, selects the type rules of companies not listed in the rule file (see
+    TypeClassifier.getRuleSet())
+    :type sector: str
+
     :return: Dictionary of company locations for every company passed in
     :rtype {str : CompanyLocations}
     """
     companyLocationsMaster = {}
     currentCoordinates = {}
+    failedQueries = []
 
-    amountOfCities = 0  # Initialising city counter
-    for city, epicentre in locationsDictionary.items():
-        LOGGER.info("Searching " + city + "...")
+    for city, epicentre in islice(locationsDictionary.items(), limitOfAmountOfCities):
+        LOGGER.info("Searching %s...", city)
         for companyName in companyNameList:
             if companyName not in companyLocationsMaster:
                 companyLocations = CompanyLocations(companyName = companyName.replace('"', ''))
@@ -154,24 +319,592 @@ def getCompanyLocationsNearLocationList(companyNameList, locationsDictionary, li
                 currentCoordinates[companyName] = []
 
             # logger.info("Company: " + companyName + "...")
-            try:
-                placesNearbyQuery(companyLocations = companyLocationsMaster[companyName], locationEpicentre = epicentre,
-                                  radiusFromEpicentre = RADIUS_OF_SEARCH, hasToBeOpen = False,
-                                  companyKeyword = companyName, coordinates = currentCoordinates)
-            except Exception as e:
-                LOGGER.exception(e)
-                LOGGER.error("Major error with {} in {}".format(companyName, city))
-                LOGGER.error("Skipping!")
-                continue
+            amountOfNewResults = searchCompanyInCity(companyLocations = companyLocationsMaster[companyName],
+                                                     companyName = companyName, city = city, epicentre = epicentre,
+                                                     coordinates = currentCoordinates, sector = sector)
+            if amountOfNewResults is None:
+                failedQueries.append((city, epicentre, companyName))
+
+        if profiler is not None:
+            profiler.markStage(city)
+
+    retryFailedQueries(failedQueries, companyLocationsMaster, currentCoordinates, sector = sector)
+
+    return companyLocationsMaster
+
+
+def getCompanyLocationsByPriority(companyNameList, citiesDictionary, limitOfAmountOfCities = 50,
+                                  epicentreOrder = EpicentreOrder.POPULATION, maxConsecutiveMisses = 5,
+                                  explorationBudget = 0, sector = None):
+    """
+    Same as getCompanyLocationsNearLocationList(), but the order of the queries is decided by a QueryScheduler: the
+    largest cities are searched first, and companies that keep coming back empty stop being searched (see
+    QueryScheduler.py for details).
+
+    :param companyNameList: A list of names of companies to be search
+    :type companyNameList: [str]
+
+    :param citiesDictionary: Output of parseCitiesCSVWithStatistics(), or a plain {cityName : coordinates} dictionary
+    :type citiesDictionary: {str : {str : object}}
+
+    :param limitOfAmountOfCities: Optional limit of amount of cities to be searched
+    :type limitOfAmountOfCities: int
+
+    :param epicentreOrder: How queries should be prioritised
+    :type epicentreOrder: EpicentreOrder
+
+    :param maxConsecutiveMisses: Amount of empty epicentres in a row after which a company is deprioritised
+    :type maxConsecutiveMisses: int
+
+    :param explorationBudget: Amount of queries that may still be spent on deprioritised companies
+    :type explorationBudget: int
+
+    :param sector: Sector of the run, selects the type rules of companies not listed in the rule file (see
+    TypeClassifier.getRuleSet())
+    :type sector: str
+
+    :return: Dictionary of company locations for every company passed in
+    :rtype {str : CompanyLocations}
+    """
+    companyLocationsMaster = {}
+    currentCoordinates = {}
+
+    for companyName in companyNameList:
+        companyLocationsMaster[companyName] = CompanyLocations(companyName = companyName.replace('"', ''))
+        currentCoordinates[companyName] = []
+
+    scheduler = QueryScheduler(companyNameList = companyNameList, epicentres = citiesDictionary,
+                               epicentreOrder = epicentreOrder, limitOfAmountOfCities = limitOfAmountOfCities,
+                               maxConsecutiveMisses = maxConsecutiveMisses, explorationBudget = explorationBudget)
+
+    failedQueries = []
+
+    for city, epicentre, companyName in scheduler:
+        amountOfNewResults = searchCompanyInCity(companyLocations = companyLocationsMaster[companyName],
+                                                 companyName = companyName, city = city, epicentre = epicentre,
+                                                 coordinates = currentCoordinates, sector = sector)
+        if amountOfNewResults is None:
+            # A failure says nothing about the company's presence, so it does not count as a miss
+            failedQueries.append((city, epicentre, companyName))
+            scheduler.recordFailure(companyName)
+        else:
+            scheduler.recordResult(companyName, amountOfNewResults)
+
+    retryFailedQueries(failedQueries, companyLocationsMaster, currentCoordinates, sector = sector)
+
+    return companyLocationsMaster
+
+
+def iterateCompanyLocations(companyNameList, locationsDictionary, limitOfAmountOfCities = 50,
+                            maxCompaniesInFlight = 1, profiler = None, sector = None):
+    """
+    Streaming version of getCompanyLocationsNearLocationList(). Companies are searched in tiles of at most
+    maxCompaniesInFlight companies; within a tile, every city is searched for every company, after which the tile's
+    CompanyLocations objects are yielded and their duplicate-tracking state is released. With the default tile size of
+    one, the search is company-major and each company is yielded as soon as its last city is done.
+
+    Only one tile is held in memory at a time, and companyNameList may itself be a generator, so this scales to company
+    lists in the tens of thousands as long as the consumer does not keep every yielded object around.
+
+    :param companyNameList: Names (or a generator of names) of companies to be searched
+    :type companyNameList: [str]
+
+    :param locationsDictionary: A set of City names and epicentre coordinates to be searched
+    :type locationsDictionary: {str : str}
+
+    :param limitOfAmountOfCities: Optional limit of amount of cities to be searched
+    :type limitOfAmountOfCities: int
+
+    :param maxCompaniesInFlight: Maximum amount of companies being searched (and held in memory) at once
+    :type maxCompaniesInFlight: int
+
+    :param profiler: Optional profiler, a stage boundary is marked after every tile
+    :type profiler: RunProfiler
+
+    :param sector: Sector of the run, selects the type rules of companies not listed in the rule file (see
+    TypeClassifier.getRuleSet())
+    :type sector: str
+
+    :return: Generator of finished company locations
+    :rtype: generator of CompanyLocations
+    """
+    if maxCompaniesInFlight is None or maxCompaniesInFlight < 1:
+        LOGGER.error("maxCompaniesInFlight must be at least 1")
+        raise ValueError
+
+    cities = list(islice(locationsDictionary.items(), limitOfAmountOfCities))
+    companyNameIterator = iter(companyNameList)
+
+    while True:
+        companyLocationsTile = {}
+        currentCoordinates = {}
+        failedQueries = []
+
+        for companyName in islice(companyNameIterator, maxCompaniesInFlight):
+            if companyName not in companyLocationsTile:
+                companyLocationsTile[companyName] = CompanyLocations(companyName = companyName.replace('"', ''))
+                currentCoordinates[companyName] = []
+
+        if not companyLocationsTile:
+            return
+
+        for city, epicentre in cities:
+            LOGGER.info("Searching %s...", city)
+            for companyName, companyLocations in companyLocationsTile.items():
+                amountOfNewResults = searchCompanyInCity(companyLocations = companyLocations, companyName = companyName,
+                                                         city = city, epicentre = epicentre,
+                                                         coordinates = currentCoordinates, sector = sector)
+                if amountOfNewResults is None:
+                    failedQueries.append((city, epicentre, companyName))
+
+        retryFailedQueries(failedQueries, companyLocationsTile, currentCoordinates, sector = sector)
+
+        if profiler is not None:
+            profiler.markStage("tile of " + ", ".join(companyLocationsTile))
+
+        for companyName in list(companyLocationsTile):
+            del currentCoordinates[companyName]
+            yield companyLocationsTile.pop(companyName)
+
+
+def placesNearbySweep(locationEpicentre, radiusFromEpicentre = RADIUS_OF_SEARCH, sweepKeyword = "", sweepType = None,
+                      maxPages = MAX_PAGES_PER_SWEEP):
+    """
+    Runs one broad places_nearby() search (by sector keyword and/or place type rather than by company name) and follows
+    its pagination, yielding every page as it arrives so that it can be processed before the next one is requested.
+
+    :param locationEpicentre: Latitude and longitude where search should be centered
+    :type locationEpicentre: str
+
+    :param radiusFromEpicentre: Radius of search centered at locationEpicenter
+    :type radiusFromEpicentre: float
+
+    :param sweepKeyword: Broad keyword to search for (e.g. "cement")
+    :type sweepKeyword: str
+
+    :param sweepType: Place type to search for (e.g. "storage")
+    :type sweepType: str
+
+    :param maxPages: Maximum amount of pages to be requested
+    :type maxPages: int
+
+    :return: Generator of the places of every page
+    :rtype: generator of [JSON]
+    """
+    nearbyRequest = getCanonicalNearbyRequest(location = locationEpicentre, radius = radiusFromEpicentre,
+                                              open_now = False, keyword = sweepKeyword or "", placeType = sweepType)
+
+    for pageNumber in range(maxPages):
+        placesResult = getNearbyPlaces(nearbyRequest)
 
-        if amountOfCities == limitOfAmountOfCities:
+        if placesResult["status"] != "OK":
+            if placesResult["status"] != "ZERO_RESULTS":
+                LOGGER.warning("Error sweeping %s/%s: %s", sweepKeyword, sweepType, placesResult["status"])
+            return
+
+        QUERY_STATISTICS["nearbyResults"] += len(placesResult['results'])
+        yield placesResult['results']
+
+        nextPageToken = placesResult.get("next_page_token")
+        if not nextPageToken:
+            return
+
+        time.sleep(PAGE_TOKEN_DELAY)
+        nearbyRequest = {"page_token": nextPageToken}
+
+
+def getCompanyLocationsBySweep(companyNameList, locationsDictionary, sweepKeywords = None, sweepTypes = None,
+                               limitOfAmountOfCities = 50, maxPagesPerSweep = MAX_PAGES_PER_SWEEP, profiler = None,
+                               sector = None):
+    """
+    Inverted version of getCompanyLocationsNearLocationList() for lists of companies from the same sector. Instead of
+    one search per company per city, every city gets a few broad sweeps (one per sector keyword and per place type,
+    fully paginated), and the name of every place returned is matched locally against all companies at once through a
+    CompanyNameIndex (see CompanyNameIndex.py for how competitors are kept apart). The amount of nearby calls therefore
+    depends on the amount of cities and sweeps, not on the amount of companies.
+
+    Detail calls are only made for places that match a company and pass its type rules, and only once per place for
+    the whole run. A failed detail call only requeues that place; a sweep is only requeued if one of its nearby calls
+    failed.
+
+    :param companyNameList: A list of names of companies to be search
+    :type companyNameList: [str]
+
+    :param locationsDictionary: A set of City names and epicentre coordinates to be searched
+    :type locationsDictionary: {str : str}
+
+    :param sweepKeywords: Broad keywords to sweep every city with (e.g. ["cement", "chemical plant"])
+    :type sweepKeywords: [str]
+
+    :param sweepTypes: Place types to sweep every city with
+    :type sweepTypes: [str]
+
+    :param limitOfAmountOfCities: Optional limit of amount of cities to be searched
+    :type limitOfAmountOfCities: int
+
+    :param maxPagesPerSweep: Maximum amount of pages requested per sweep
+    :type maxPagesPerSweep: int
+
+    :param profiler: Optional profiler, a stage boundary is marked after every city
+    :type profiler: RunProfiler
+
+    :param sector: Sector of the run, selects the type rules of companies not listed in the rule file (see
+    TypeClassifier.getRuleSet())
+    :type sector: str
+
+    :return: Dictionary of company locations for every company passed in
+    :rtype {str : CompanyLocations}
+    """
+    sweeps = [(sweepKeyword, None) for sweepKeyword in sweepKeywords or []] + \
+             [("", sweepType) for sweepType in sweepTypes or []]
+    if not sweeps:
+        LOGGER.error("At least one sweep keyword or type is needed")
+        raise ValueError
+
+    # Sweep keywords are in most names a sweep returns, so they say nothing about which company a place belongs to
+    companyNameIndex = CompanyNameIndex(companyNameList, filterType = FUZZY_FILTER_TYPE,
+                                        threshold = FUZZY_FILTER_THRESHOLD, ignoredWords = sweepKeywords)
+    sweepState = {
+        "companyNameIndex": companyNameIndex,
+        "companyLocationsMaster": {},
+        "coordinates": {},
+        "placeDetails": {},  # Details already requested this run, by place ID
+        "maxPages": maxPagesPerSweep,
+        "sector": sector,
+    }
+    for companyName in companyNameList:
+        sweepState["companyLocationsMaster"][companyName] = CompanyLocations(companyName = companyName.replace('"', ''))
+        sweepState["coordinates"][companyName] = []
+
+    failedSweeps = []
+    failedPlaces = []
+
+    for city, epicentre in islice(locationsDictionary.items(), limitOfAmountOfCities):
+        LOGGER.info("Sweeping %s...", city)
+        for sweepKeyword, sweepType in sweeps:
+            isSweepDone, newFailedPlaces = sweepCity(sweepState, city, epicentre, sweepKeyword, sweepType)
+            failedPlaces.extend(newFailedPlaces)
+            if not isSweepDone:
+                failedSweeps.append((city, epicentre, sweepKeyword, sweepType))
+
+        if profiler is not None:
+            profiler.markStage(city)
+
+    for roundNumber in range(1, MAX_REQUEUE_ROUNDS + 1):
+        failedPlaces = list(dict.fromkeys(failedPlaces))
+        if not failedSweeps and not failedPlaces:
             break
-        amountOfCities += 1
 
-        if amountOfCities > len(locationsDictionary):
+        requeueDelay = getRequeueDelay(roundNumber)
+        LOGGER.info("Retrying %d failed sweeps and %d failed detail lookups in %.1f seconds (round %d of %d)",
+                    len(failedSweeps), len(failedPlaces), requeueDelay, roundNumber, MAX_REQUEUE_ROUNDS)
+        time.sleep(requeueDelay)
+
+        stillFailedPlaces = [(placeID, placeName, companyName) for placeID, placeName, companyName in failedPlaces
+                             if not addSweptPlace(sweepState, placeID, placeName, companyName)]
+
+        stillFailedSweeps = []
+        for city, epicentre, sweepKeyword, sweepType in failedSweeps:
+            isSweepDone, newFailedPlaces = sweepCity(sweepState, city, epicentre, sweepKeyword, sweepType)
+            stillFailedPlaces.extend(newFailedPlaces)
+            if not isSweepDone:
+                stillFailedSweeps.append((city, epicentre, sweepKeyword, sweepType))
+
+        failedSweeps = stillFailedSweeps
+        failedPlaces = stillFailedPlaces
+
+    for city, _, sweepKeyword, sweepType in failedSweeps:
+        LOGGER.error("Giving up on sweep %s/%s in %s", sweepKeyword, sweepType, city)
+    for _, placeName, companyName in dict.fromkeys(failedPlaces):
+        LOGGER.error("Giving up on %s for %s", placeName, companyName)
+
+    return sweepState["companyLocationsMaster"]
+
+
+def sweepCity(sweepState, city, epicentre, sweepKeyword, sweepType):
+    """
+    Runs one sweep of one city and adds every place matching a company to that company's locations (see
+    getCompanyLocationsBySweep()). Pages are processed as they arrive, so a failed nearby call only loses the pages
+    after it; places already added are not duplicated if the sweep is retried.
+
+    :param sweepState: Index, results and caches shared by every sweep of the run
+    :type sweepState: {str : object}
+
+    :return: Whether the sweep is done (False if it failed and should be retried), and the (place ID, place name,
+    company name) of every place whose detail lookup should be retried
+    :rtype: (bool, [(str, str, str)])
+    """
+    failedPlaces = []
+
+    try:
+        for places in placesNearbySweep(locationEpicentre = epicentre, radiusFromEpicentre = RADIUS_OF_SEARCH,
+                                        sweepKeyword = sweepKeyword, sweepType = sweepType,
+                                        maxPages = sweepState["maxPages"]):
+            for place in places:
+                companyName = sweepState["companyNameIndex"].match(place['name'])
+                if companyName is None:
+                    continue
+
+                isTypeAccepted, typeReason = TYPE_CLASSIFIER.classify(place.get('types', []),
+                                                                      companyName = companyName,
+                                                                      sector = sweepState["sector"])
+                if not isTypeAccepted:
+                    TYPE_REJECTIONS[typeReason] += 1
+                    LOGGER.debug("Type rejection %s: %s (%s)", companyName, place['name'], typeReason)
+                    continue
+
+                if not addSweptPlace(sweepState, place['place_id'], place['name'], companyName):
+                    failedPlaces.append((place['place_id'], place['name'], companyName))
+    except CircuitOpenError:
+        LOGGER.warning("Circuit open, requeueing sweep %s/%s in %s", sweepKeyword, sweepType, city)
+        return False, failedPlaces
+    except Exception as e:
+        LOGGER.exception(e)
+        LOGGER.error("Major error sweeping %s/%s in %s", sweepKeyword, sweepType, city)
+        if not isRetriableError(e):
+            LOGGER.error("Not retriable, skipping!")
+            return True, failedPlaces
+        LOGGER.error("Requeueing!")
+        return False, failedPlaces
+
+    return True, failedPlaces
+
+
+def addSweptPlace(sweepState, placeID, placeName, companyName):
+    """
+    Looks up the details of a place found by a sweep (once per run) and adds it to the locations of the company it
+    matched.
+
+    :param sweepState: Index, results and caches shared by every sweep of the run
+    :type sweepState: {str : object}
+
+    :return: False if the detail lookup failed and should be retried, True otherwise
+    :rtype: bool
+    """
+    placeDetails = sweepState["placeDetails"]
+
+    if placeID not in placeDetails:
+        try:
+            placeDetails[placeID] = getPlaceDetails(placeID)
+        except CircuitOpenError:
+            LOGGER.warning("Circuit open, requeueing details of %s", placeName)
+            return False
+        except Exception as e:
+            LOGGER.exception(e)
+            LOGGER.error("Major error extracting details of %s", placeName)
+            if not isRetriableError(e):
+                LOGGER.error("Not retriable, skipping!")
+                return True
+            LOGGER.error("Requeueing!")
+            return False
+
+    if placeDetails[placeID]['status'] != "OK":
+        LOGGER.warning("Error extracting details of %s: %s", placeName, placeDetails[placeID]["status"])
+        return True
+
+    addPlaceToCompanyLocations(companyLocations = sweepState["companyLocationsMaster"][companyName],
+                               companyKeyword = companyName, placeInformation = placeDetails[placeID],
+                               coordinates = sweepState["coordinates"], sector = sweepState["sector"])
+    return True
+
+
+def searchCompanyInCity(companyLocations, companyName, city, epicentre, coordinates, sector = None):
+    """
+    Runs placesNearbyQuery() for one company in one city. A retriable failure (see isRetriableError()) is logged and
+    reported to the caller so that the pair can be requeued; any other error is logged and the pair skipped.
+
+    :param companyLocations: Company locations collected thus far for this company
+    :type companyLocations: CompanyLocations
+
+    :param companyName: The actual name of the company to be queried into Google Places API
+    :type companyName: str
+
+    :param city: Name of the city being searched, used for logging
+    :type city: str
+
+    :param epicentre: Latitude and longitude where search should be centered
+    :type epicentre: str
+
+    :param coordinates: Dictionary to keep track of already-seen coordinates
+    :type coordinates: {str : [(float, float]}
+
+    :param sector: Sector of the run, selects the type rules of companies not listed in the rule file (see
+    TypeClassifier.getRuleSet())
+    :type sector: str
+
+    :return: Amount of new results added to companyLocations, or None if the search failed and may be retried
+    :rtype: int
+    """
+    amountOfResultsBefore = len(companyLocations.getQueryResultList())
+
+    try:
+        placesNearbyQuery(companyLocations = companyLocations, locationEpicentre = epicentre,
+                          radiusFromEpicentre = RADIUS_OF_SEARCH, hasToBeOpen = False,
+                          companyKeyword = companyName, coordinates = coordinates, sector = sector)
+    except CircuitOpenError:
+        LOGGER.warning("Circuit open, requeueing %s in %s", companyName, city)
+        return None
+    except Exception as e:
+        LOGGER.exception(e)
+        LOGGER.error("Major error with %s in %s", companyName, city)
+        if not isRetriableError(e):
+            LOGGER.error("Not retriable, skipping!")
+            return len(companyLocations.getQueryResultList()) - amountOfResultsBefore
+        LOGGER.error("Requeueing!")
+        return None
+
+    return len(companyLocations.getQueryResultList()) - amountOfResultsBefore
+
+
+def isRetriableError(error):
+    """
+    Whether a failed call may succeed if made again: missed deadlines, open circuits, transport errors and transient API
+    statuses (RETRIABLE_API_STATUSES) are; any other error would be paid for again for the same outcome
+
+    :rtype: bool
+    """
+    if isinstance(error, googlemaps.exceptions.ApiError):
+        return error.status in RETRIABLE_API_STATUSES
+
+    return isinstance(error, (CircuitOpenError, TimeoutError, googlemaps.exceptions.TransportError,
+                              googlemaps.exceptions.Timeout))
+
+
+def getRequeueDelay(roundNumber, backoffSeconds = REQUEUE_BACKOFF):
+    """
+    Seconds to wait before a retry round: exponential backoff, or longer if the circuit breaker is still open
+
+    :rtype: float
+    """
+    return max(backoffSeconds * 2 ** (roundNumber - 1), CIRCUIT_BREAKER.getSecondsUntilProbe())
+
+
+def retryFailedQueries(failedQueries, companyLocationsMaster, coordinates, maxRounds = MAX_REQUEUE_ROUNDS,
+                       sector = None):
+    """
+    Retries (city, epicentre, companyName) pairs whose search failed, for up to maxRounds rounds. Before each round it
+    backs off (see getRequeueDelay()), waiting for the circuit breaker to let calls through again if need be. Results
+    already added by a partially failed search are not duplicated, since coordinates are tracked per company.
+
+    :param failedQueries: Pairs whose search failed
+    :type failedQueries: [(str, str, str)]
+
+    :param companyLocationsMaster: Company locations collected thus far, keyed by company name
+    :type companyLocationsMaster: {str : CompanyLocations}
+
+    :param coordinates: Dictionary to keep track of already-seen coordinates
+    :type coordinates: {str : [(float, float]}
+
+    :param maxRounds: Amount of retry rounds
+    :type maxRounds: int
+
+    :param sector: Sector of the run, selects the type rules of companies not listed in the rule file (see
+    TypeClassifier.getRuleSet())
+    :type sector: str
+
+    :return: Pairs that still failed after the last round
+    :rtype: [(str, str, str)]
+    """
+    for roundNumber in range(1, maxRounds + 1):
+        if not failedQueries:
             break
 
-    return companyLocationsMaster
+        requeueDelay = getRequeueDelay(roundNumber)
+        LOGGER.info("Retrying %d failed searches in %.1f seconds (round %d of %d)", len(failedQueries), requeueDelay,
+                    roundNumber, maxRounds)
+        time.sleep(requeueDelay)
+
+        stillFailedQueries = []
+        for city, epicentre, companyName in failedQueries:
+            amountOfNewResults = searchCompanyInCity(companyLocations = companyLocationsMaster[companyName],
+                                                     companyName = companyName, city = city, epicentre = epicentre,
+                                                     coordinates = coordinates, sector = sector)
+            if amountOfNewResults is None:
+                stillFailedQueries.append((city, epicentre, companyName))
+
+        failedQueries = stillFailedQueries
+
+    for city, _, companyName in failedQueries:
+        LOGGER.error("Giving up on %s in %s", companyName, city)
+
+    return failedQueries
+
+
+def getCanonicalNearbyRequest(location, radius, open_now, keyword, placeType = None):
+    """
+    Canonical form of a places_nearby() request, so that requests that would return the same results compare equal
+
+    :param location: Latitude and longitude in string form (e.g. "1.2345,6.789")
+    :type location: str
+
+    :param radius: Radius of search in metres
+    :type radius: float
+
+    :param open_now: Whether only open places should be returned
+    :type open_now: bool
+
+    :param keyword: Search keyword
+    :type keyword: str
+
+    :param placeType: Optional place type to restrict the search to
+    :type placeType: str
+
+    :return: Keyword arguments for places_nearby()
+    :rtype: {str : object}
+    """
+    latitude, longitude = (round(float(coordinate), COORDINATE_PRECISION) for coordinate in location.split(","))
+
+    nearbyRequest = {
+        "location": "{},{}".format(latitude, longitude),
+        "radius": int(radius),
+        "open_now": bool(open_now),
+        "keyword": " ".join(keyword.lower().split()),
+    }
+    if placeType:
+        nearbyRequest["type"] = placeType.strip().lower()
+
+    return nearbyRequest
+
+
+def getCanonicalDetailsRequest(place_id, fields):
+    """
+    Canonical form of a place() request
+
+    :param place_id: Google Places ID of the place
+    :type place_id: str
+
+    :param fields: Fields to be returned
+    :type fields: [str]
+
+    :return: Keyword arguments for place()
+    :rtype: {str : object}
+    """
+    return {
+        "place_id": place_id.strip(),
+        "fields": sorted(set(fields)),
+    }
+
+
+def getRequestKey(request):
+    """
+    :param request: Canonical request (see getCanonicalNearbyRequest() and getCanonicalDetailsRequest())
+    :type request: {str : object}
+
+    :return: Hashable key identifying the request
+    :rtype: tuple
+    """
+    return tuple(sorted((name, tuple(value) if isinstance(value, list) else value) for name, value in request.items()))
+
+
+def getSingleFlightCounters():
+    """
+    :return: Per request type, how many calls were made, actually sent, and collapsed into an identical in-flight one
+    :rtype: {str : {str : int}}
+    """
+    return {
+        "places_nearby": NEARBY_FLIGHTS.getCounters(),
+        "place": DETAILS_FLIGHTS.getCounters(),
+    }
 
 
 def getIsPermanentlyClosed(placeInformation = None):
@@ -0,0 +1,284 @@
+import time
+import logging
+import threading
+from enum import Enum
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from LoggingSetup import configureLogging
+
+configureLogging()
+LOGGER = logging.getLogger()
+
+"""
+Latency-aware wrappers around Places API calls. A LatencyGuard gives every call a deadline, optionally fires a hedged
+duplicate of idempotent calls once they run past the observed p95 latency, and reports every outcome to a
+CircuitBreaker, which stops calls from being sent at all while the error rate is too high.
+"""
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of making a call while the circuit breaker is open
+    """
+    pass
+
+
+class CircuitState(Enum):
+    CLOSED = 0     # Calls go through
+    OPEN = 1       # Calls are refused until the cooldown has passed
+    HALF_OPEN = 2  # A single probe call is let through to decide whether to close again
+
+
+class LatencyTracker:
+    """
+    Rolling window of call latencies
+    """
+
+    def __init__(self, windowSize = 200, minimumSamples = 20):
+        """
+        :param windowSize: Amount of latest latencies kept
+        :type windowSize: int
+
+        :param minimumSamples: Amount of samples needed before a percentile is reported
+        :type minimumSamples: int
+        """
+        self.latencies = deque(maxlen = windowSize)
+        self.minimumSamples = minimumSamples
+        self.lock = threading.Lock()
+
+    def addLatency(self, seconds):
+        with self.lock:
+            self.latencies.append(seconds)
+
+    def getPercentile(self, percentile = 95):
+        """
+        :return: Latency (seconds) at the given percentile, or None if too few calls have been seen
+        :rtype: float
+        """
+        with self.lock:
+            if len(self.latencies) < self.minimumSamples:
+                return None
+            sortedLatencies = sorted(self.latencies)
+
+        index = min(len(sortedLatencies) - 1, int(len(sortedLatencies) * percentile / 100.0))
+        return sortedLatencies[index]
+
+
+class CircuitBreaker:
+    """
+    Opens once the share of failed calls in the latest window reaches errorRateThreshold. While open, calls are refused
+    for cooldownSeconds; after that a single probe is let through, and its outcome either closes the circuit or opens it
+    for another cooldown.
+    """
+
+    def __init__(self, errorRateThreshold = 0.5, windowSize = 20, minimumCalls = 10, cooldownSeconds = 30.0):
+        """
+        :param errorRateThreshold: Share of failed calls at which the circuit opens
+        :type errorRateThreshold: float
+
+        :param windowSize: Amount of latest outcomes considered
+        :type windowSize: int
+
+        :param minimumCalls: Amount of outcomes needed before the circuit can open
+        :type minimumCalls: int
+
+        :param cooldownSeconds: How long the circuit stays open before probing
+        :type cooldownSeconds: float
+        """
+        self.errorRateThreshold = errorRateThreshold
+        self.minimumCalls = minimumCalls
+        self.cooldownSeconds = cooldownSeconds
+        self.outcomes = deque(maxlen = windowSize)
+        self.state = CircuitState.CLOSED
+        self.openedAt = 0.0
+        self.isProbeInFlight = False
+        self.lock = threading.Lock()
+
+    def allowCall(self):
+        """
+        :return: Whether a call may be made now. In the half-open state, only the first caller is allowed through
+        :rtype: bool
+        """
+        with self.lock:
+            if self.state == CircuitState.OPEN and time.monotonic() - self.openedAt >= self.cooldownSeconds:
+                LOGGER.info("Circuit half-open, probing")
+                self.state = CircuitState.HALF_OPEN
+
+            if self.state == CircuitState.CLOSED:
+                return True
+
+            if self.state == CircuitState.HALF_OPEN and not self.isProbeInFlight:
+                self.isProbeInFlight = True
+                return True
+
+            return False
+
+    def recordSuccess(self):
+        with self.lock:
+            if self.state == CircuitState.HALF_OPEN:
+                LOGGER.info("Probe succeeded, circuit closed")
+                self.state = CircuitState.CLOSED
+                self.outcomes.clear()
+                self.isProbeInFlight = False
+            self.outcomes.append(True)
+
+    def recordFailure(self):
+        with self.lock:
+            self.outcomes.append(False)
+
+            if self.state == CircuitState.HALF_OPEN:
+                self.open()
+                return
+
+            amountOfFailures = self.outcomes.count(False)
+            if self.state == CircuitState.CLOSED and len(self.outcomes) >= self.minimumCalls and \
+                    amountOfFailures / len(self.outcomes) >= self.errorRateThreshold:
+                self.open()
+
+    def open(self):
+        LOGGER.warning("Circuit opened, refusing calls for %.1f seconds", self.cooldownSeconds)
+        self.state = CircuitState.OPEN
+        self.openedAt = time.monotonic()
+        self.isProbeInFlight = False
+
+    def getState(self):
+        return self.state
+
+    def getSecondsUntilProbe(self):
+        """
+        :return: Seconds until the circuit lets a probe through (0 if calls are allowed now)
+        :rtype: float
+        """
+        with self.lock:
+            if self.state != CircuitState.OPEN:
+                return 0.0
+
+            return max(0.0, self.cooldownSeconds - (time.monotonic() - self.openedAt))
+
+
+class LatencyGuard:
+    """
+    Runs calls on a shared thread pool so that they can be given a deadline and, if isIdempotent, be hedged: once a
+    call has been running for longer than the p95 of recent latencies, an identical call is sent and whichever finishes
+    first wins.
+
+    Once a call returns or raises, its other attempts are cancelled if they have not been sent yet. A deadline only
+    stops the caller from waiting; an abandoned request that is already running finishes (or times out in the client,
+    which should therefore have a timeout of its own) in the background.
+    """
+
+    def __init__(self, name, deadlineSeconds = 10.0, isIdempotent = False, hedgePercentile = 95,
+                 circuitBreaker = None, latencyTracker = None, maxWorkers = 8, isFailure = None):
+        """
+        :param name: Name used in log messages and counters
+        :type name: str
+
+        :param deadlineSeconds: Longest a caller waits for a result
+        :type deadlineSeconds: float
+
+        :param isIdempotent: Whether the call may safely be sent twice (enables hedging)
+        :type isIdempotent: bool
+
+        :param hedgePercentile: Latency percentile after which a hedged duplicate is sent
+        :type hedgePercentile: float
+
+        :param circuitBreaker: Breaker shared by every guard calling the same backend
+        :type circuitBreaker: CircuitBreaker
+
+        :param latencyTracker: Latency window used for hedging
+        :type latencyTracker: LatencyTracker
+
+        :param maxWorkers: Size of the thread pool
+        :type maxWorkers: int
+
+        :param isFailure: Whether an exception raised by the call says the backend is unhealthy and should count against
+        the circuit breaker. Errors it rejects (e.g. an invalid request) count as successful calls. Missed deadlines
+        always count. By default every exception does.
+        :type isFailure: function
+        """
+        self.name = name
+        self.deadlineSeconds = deadlineSeconds
+        self.isIdempotent = isIdempotent
+        self.hedgePercentile = hedgePercentile
+        self.circuitBreaker = circuitBreaker or CircuitBreaker()
+        self.latencyTracker = latencyTracker or LatencyTracker()
+        self.isFailure = isFailure or (lambda error: True)
+        self.executor = ThreadPoolExecutor(max_workers = maxWorkers, thread_name_prefix = name)
+        self.counters = {"calls": 0, "hedges": 0, "hedgeWins": 0, "timeouts": 0, "errors": 0, "refused": 0,
+                         "cancelled": 0}
+
+    def timedCall(self, function, args, kwargs):
+        startTime = time.monotonic()
+        result = function(*args, **kwargs)
+        self.latencyTracker.addLatency(time.monotonic() - startTime)
+
+        return result
+
+    def cancelPending(self, futures):
+        """
+        Cancels the attempts of a call that have not started running yet, so that nothing is sent (and billed) for a
+        caller that is no longer waiting
+        """
+        for future in futures:
+            if not future.done() and future.cancel():
+                self.counters["cancelled"] += 1
+
+    def call(self, function, *args, **kwargs):
+        """
+        Calls function(*args, **kwargs) under this guard's deadline, hedging and circuit breaker.
+
+        :raises CircuitOpenError: If the circuit breaker refuses the call
+        :raises TimeoutError: If no result arrived before the deadline
+        :raises Exception: Whatever the call itself raised
+
+        :return: What function returned
+        """
+        if not self.circuitBreaker.allowCall():
+            self.counters["refused"] += 1
+            raise CircuitOpenError(self.name + " refused, circuit is open")
+
+        self.counters["calls"] += 1
+        startTime = time.monotonic()
+        futures = [self.executor.submit(self.timedCall, function, args, kwargs)]
+
+        hedgeDelay = self.latencyTracker.getPercentile(self.hedgePercentile) if self.isIdempotent else None
+        if hedgeDelay is not None and hedgeDelay < self.deadlineSeconds:
+            done, _ = wait(futures, timeout = hedgeDelay)
+            if not done:
+                LOGGER.debug("%s slower than p%d (%.2fs), hedging", self.name, self.hedgePercentile, hedgeDelay)
+                self.counters["hedges"] += 1
+                futures.append(self.executor.submit(self.timedCall, function, args, kwargs))
+
+        error = None
+        pending = set(futures)
+        while pending:
+            remainingSeconds = self.deadlineSeconds - (time.monotonic() - startTime)
+            if remainingSeconds <= 0:
+                break
+
+            done, pending = wait(pending, timeout = remainingSeconds, return_when = FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is not futures[0]:
+                        self.counters["hedgeWins"] += 1
+                    self.circuitBreaker.recordSuccess()
+                    self.cancelPending(pending)
+                    return future.result()
+                error = future.exception()
+
+        self.cancelPending(pending)
+
+        if pending or error is None:
+            self.circuitBreaker.recordFailure()
+            self.counters["timeouts"] += 1
+            raise TimeoutError(self.name + " exceeded its deadline of " + str(self.deadlineSeconds) + " seconds")
+
+        if self.isFailure(error):
+            self.circuitBreaker.recordFailure()
+        else:
+            self.circuitBreaker.recordSuccess()
+        self.counters["errors"] += 1
+        raise error
+
+    def getCounters(self):
+        return self.counters
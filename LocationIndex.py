@@ -0,0 +1,242 @@
+import json
+import logging
+import numpy as np
+from scipy.spatial import cKDTree
+from CompanyLocations import getLocationRecords
+from LoggingSetup import configureLogging
+
+configureLogging()
+LOGGER = logging.getLogger()
+EARTH_RADIUS = 6371008.8  # metres
+
+
+def convertToUnitVectors(latitudes, longitudes):
+    """
+    Projects coordinates onto the unit sphere. Straight-line (chord) distance between two of these vectors grows
+    monotonically with their great-circle distance, so an ordinary KD-tree over them answers haversine queries exactly.
+
+    :param latitudes: Latitudes in degrees
+    :type latitudes: numpy.ndarray
+
+    :param longitudes: Longitudes in degrees
+    :type longitudes: numpy.ndarray
+
+    :return: Array of shape (n, 3)
+    :rtype: numpy.ndarray
+    """
+    latitudes = np.radians(np.asarray(latitudes, dtype = float))
+    longitudes = np.radians(np.asarray(longitudes, dtype = float))
+    cosLatitudes = np.cos(latitudes)
+
+    return np.column_stack((cosLatitudes * np.cos(longitudes), cosLatitudes * np.sin(longitudes), np.sin(latitudes)))
+
+
+def convertChordToMetres(chordDistances):
+    return 2.0 * EARTH_RADIUS * np.arcsin(np.clip(np.asarray(chordDistances) / 2.0, 0.0, 1.0))
+
+
+def convertMetresToChord(distances):
+    return 2.0 * np.sin(np.minimum(np.asarray(distances, dtype = float), np.pi * EARTH_RADIUS) / (2.0 * EARTH_RADIUS))
+
+
+class LocationIndex:
+    """
+    Indexed store of the locations collected in a run. Locations are kept in a KD-tree over their positions on the unit
+    sphere (one tree for all locations, plus one per company, built on first use), so nearest-neighbour and radius
+    lookups do not need to scan every record. All query methods accept arrays of query points.
+
+    Distances are great-circle distances in metres.
+    """
+
+    def __init__(self, records = None):
+        """
+        :param records: Flattened location records (see CompanyLocations.getLocationRecords())
+        :type records: [dict]
+        """
+        if records is None:
+            records = []
+
+        self.records = records
+        self.latitudes = np.array([record["lat"] for record in records], dtype = float)
+        self.longitudes = np.array([record["lon"] for record in records], dtype = float)
+        self.companyNames = np.array([record["companyName"] for record in records], dtype = object)
+        self.tree = cKDTree(convertToUnitVectors(self.latitudes, self.longitudes)) if records else None
+        self.companyTrees = {}
+
+        # Latitude-sorted view for bounding box queries
+        self.latitudeOrder = np.argsort(self.latitudes, kind = "stable")
+        self.sortedLatitudes = self.latitudes[self.latitudeOrder]
+
+        LOGGER.debug("Location index built with %d locations", len(records))
+
+    @classmethod
+    def fromCompanyLocations(cls, companyLocationsMaster):
+        """
+        :param companyLocationsMaster: Output of getCompanyLocationsNearLocationList(), or any iterable of
+        CompanyLocations objects
+        :type companyLocationsMaster: {str : CompanyLocations} or [CompanyLocations]
+
+        :rtype: LocationIndex
+        """
+        if isinstance(companyLocationsMaster, dict):
+            companyLocationsMaster = companyLocationsMaster.values()
+
+        records = []
+        for companyLocations in companyLocationsMaster:
+            records.extend(getLocationRecords(companyLocations))
+
+        return cls(records)
+
+    @classmethod
+    def fromJSONFile(cls, filename):
+        """
+        Loads the output of example.py, i.e. one JSON object per company per line. A file containing a single JSON
+        array of company objects is also accepted.
+
+        :param filename: Address of the JSON/JSONL file to be read
+        :type filename: str
+
+        :rtype: LocationIndex
+        """
+        if filename is None:
+            LOGGER.error("filename is null")
+            raise TypeError
+
+        with open(filename, 'r') as file:
+            contents = file.read().strip()
+
+        if contents.startswith("["):
+            companies = json.loads(contents)
+        else:
+            companies = [json.loads(line) for line in contents.splitlines() if line.strip()]
+
+        records = []
+        for company in companies:
+            records.extend(getLocationRecords(company))
+
+        return cls(records)
+
+    def __len__(self):
+        return len(self.records)
+
+    def getRecords(self, indices):
+        """
+        :param indices: Indices returned by one of the query methods
+        :type indices: [int]
+
+        :rtype: [dict]
+        """
+        return [self.records[index] for index in np.asarray(indices, dtype = int).ravel()]
+
+    def getTree(self, companyName = None):
+        """
+        :return: The tree to be queried, and the global indices of the records it contains (None for the global tree)
+        :rtype: (scipy.spatial.cKDTree, numpy.ndarray)
+        """
+        if companyName is None:
+            return self.tree, None
+
+        if companyName not in self.companyTrees:
+            companyIndices = np.flatnonzero(self.companyNames == companyName)
+            if len(companyIndices) == 0:
+                self.companyTrees[companyName] = (None, companyIndices)
+            else:
+                unitVectors = convertToUnitVectors(self.latitudes[companyIndices], self.longitudes[companyIndices])
+                self.companyTrees[companyName] = (cKDTree(unitVectors), companyIndices)
+
+        return self.companyTrees[companyName]
+
+    def nearest(self, latitudes, longitudes, k = 1, companyName = None):
+        """
+        Finds the k nearest locations to every query point.
+
+        :param latitudes: Latitudes of query points
+        :type latitudes: float or [float]
+
+        :param longitudes: Longitudes of query points
+        :type longitudes: float or [float]
+
+        :param k: Amount of neighbours to return per point
+        :type k: int
+
+        :param companyName: Only consider locations of this company
+        :type companyName: str
+
+        :return: Distances in metres and record indices, both of shape (amountOfPoints, k). Missing neighbours have
+        an infinite distance and an index of -1
+        :rtype: (numpy.ndarray, numpy.ndarray)
+        """
+        queryPoints = convertToUnitVectors(np.atleast_1d(latitudes), np.atleast_1d(longitudes))
+        tree, companyIndices = self.getTree(companyName)
+
+        if tree is None:
+            return np.full((len(queryPoints), k), np.inf), np.full((len(queryPoints), k), -1, dtype = int)
+
+        chordDistances, indices = tree.query(queryPoints, k = k)
+        chordDistances = np.asarray(chordDistances, dtype = float).reshape(len(queryPoints), k)
+        indices = np.asarray(indices, dtype = int).reshape(len(queryPoints), k)
+
+        isMissing = indices >= tree.n
+        indices = np.where(isMissing, -1, indices)
+        if companyIndices is not None:
+            indices = np.where(isMissing, -1, companyIndices[np.minimum(indices, tree.n - 1)])
+
+        return np.where(isMissing, np.inf, convertChordToMetres(np.where(isMissing, 0.0, chordDistances))), indices
+
+    def withinRadius(self, latitudes, longitudes, radius, companyName = None):
+        """
+        Finds every location within a given distance of every query point.
+
+        :param latitudes: Latitudes of query points
+        :type latitudes: float or [float]
+
+        :param longitudes: Longitudes of query points
+        :type longitudes: float or [float]
+
+        :param radius: Search radius in metres
+        :type radius: float
+
+        :param companyName: Only consider locations of this company
+        :type companyName: str
+
+        :return: One array of record indices per query point
+        :rtype: [numpy.ndarray]
+        """
+        queryPoints = convertToUnitVectors(np.atleast_1d(latitudes), np.atleast_1d(longitudes))
+        tree, companyIndices = self.getTree(companyName)
+
+        if tree is None:
+            return [np.empty(0, dtype = int) for _ in range(len(queryPoints))]
+
+        neighbourLists = tree.query_ball_point(queryPoints, r = float(convertMetresToChord(radius)))
+
+        if companyIndices is None:
+            return [np.asarray(sorted(neighbours), dtype = int) for neighbours in neighbourLists]
+
+        return [np.sort(companyIndices[np.asarray(neighbours, dtype = int)]) for neighbours in neighbourLists]
+
+    def withinBoundingBox(self, minLatitude, minLongitude, maxLatitude, maxLongitude, companyName = None):
+        """
+        Finds every location inside a latitude/longitude box. If minLongitude is greater than maxLongitude, the box is
+        taken to cross the antimeridian.
+
+        :param companyName: Only consider locations of this company
+        :type companyName: str
+
+        :return: Record indices inside the box
+        :rtype: numpy.ndarray
+        """
+        lowerBound = np.searchsorted(self.sortedLatitudes, minLatitude, side = "left")
+        upperBound = np.searchsorted(self.sortedLatitudes, maxLatitude, side = "right")
+        candidates = self.latitudeOrder[lowerBound:upperBound]
+        candidateLongitudes = self.longitudes[candidates]
+
+        if minLongitude <= maxLongitude:
+            isInside = (candidateLongitudes >= minLongitude) & (candidateLongitudes <= maxLongitude)
+        else:
+            isInside = (candidateLongitudes >= minLongitude) | (candidateLongitudes <= maxLongitude)
+
+        if companyName is not None:
+            isInside &= self.companyNames[candidates] == companyName
+
+        return np.sort(candidates[isInside])
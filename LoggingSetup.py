@@ -0,0 +1,221 @@
+import sys
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+"""
+Central logging configuration. Every module calls configureLogging() instead of logging.basicConfig(); only the first
+call (or one with force = True, e.g. from example.py) has any effect, and, as with basicConfig(), none has if the
+application importing these modules already gave the root logger handlers.
+
+Records are put on an in-memory queue by the thread that logs them and written out by a background QueueListener, so
+the query threads never wait on I/O. Messages are formatted on the listener thread as well, which is why arguments
+should be passed lazily (LOGGER.info("Searching %s...", city)) and should not be mutated after being logged.
+
+High-volume messages (e.g. fuzzy string non-matches) are sampled by an EventSampler: per message template, the first
+maxEventsPerInterval records of every interval are kept and, after that, one in every sampleRate. Warnings and errors
+are never dropped.
+"""
+
+DEFAULT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+DEFAULT_LEVEL = logging.DEBUG
+STANDARD_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+QUEUE_LISTENER = None
+IS_CONFIGURED = False
+CONFIGURATION_LOCK = threading.Lock()
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats every record as a single JSON object. Anything passed through `extra` is included as its own field.
+    """
+
+    def format(self, record):
+        structuredRecord = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "message": record.getMessage(),
+            "module": record.module,
+            "line": record.lineno,
+            "thread": record.threadName,
+        }
+
+        for attributeName, value in vars(record).items():
+            if attributeName not in STANDARD_RECORD_ATTRIBUTES:
+                structuredRecord[attributeName] = value
+
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            structuredRecord["exception"] = record.exc_text
+
+        return json.dumps(structuredRecord, default = str)
+
+
+class EventSampler(logging.Filter):
+    """
+    Rate limits records per message template (record.msg, i.e. before the arguments are merged in). Records below
+    minimumUnsampledLevel beyond maxEventsPerInterval in the current interval are only kept one in sampleRate times;
+    kept records carry the amount suppressed since the last one in record.suppressed.
+    """
+
+    def __init__(self, maxEventsPerInterval = 100, intervalSeconds = 1.0, sampleRate = 100,
+                 minimumUnsampledLevel = logging.WARNING):
+        """
+        :param maxEventsPerInterval: Records per template kept in full every interval
+        :type maxEventsPerInterval: int
+
+        :param intervalSeconds: Length of an interval
+        :type intervalSeconds: float
+
+        :param sampleRate: Once over the limit, one record in this many is kept
+        :type sampleRate: int
+
+        :param minimumUnsampledLevel: Records at or above this level are always kept
+        :type minimumUnsampledLevel: int
+        """
+        super().__init__()
+        self.maxEventsPerInterval = maxEventsPerInterval
+        self.intervalSeconds = intervalSeconds
+        self.sampleRate = max(1, sampleRate)
+        self.minimumUnsampledLevel = minimumUnsampledLevel
+        self.eventCounts = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= self.minimumUnsampledLevel:
+            return True
+
+        currentTime = time.monotonic()
+        with self.lock:
+            intervalStart, amountInInterval, amountSuppressed = self.eventCounts.get(record.msg, (currentTime, 0, 0))
+            if currentTime - intervalStart >= self.intervalSeconds:
+                intervalStart, amountInInterval = currentTime, 0
+            amountInInterval += 1
+
+            isKept = amountInInterval <= self.maxEventsPerInterval or \
+                (amountInInterval - self.maxEventsPerInterval) % self.sampleRate == 0
+
+            if isKept:
+                if amountSuppressed:
+                    record.suppressed = amountSuppressed
+                amountSuppressed = 0
+            else:
+                amountSuppressed += 1
+
+            self.eventCounts[record.msg] = (intervalStart, amountInInterval, amountSuppressed)
+
+        return isKept
+
+
+class LazyQueueHandler(QueueHandler):
+    """
+    QueueHandler that leaves message formatting to the listener thread. Only tracebacks are rendered up front, so that
+    the queued record does not keep the failing frames alive.
+    """
+
+    def prepare(self, record):
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+
+        return record
+
+
+def configureLogging(level = DEFAULT_LEVEL, jsonFormat = False, stream = None, filename = None,
+                     maxEventsPerInterval = 100, intervalSeconds = 1.0, sampleRate = 100, force = False):
+    """
+    Routes every record of the root logger through a queue to a background writer.
+
+    :param level: Level of the root logger
+    :type level: int
+
+    :param jsonFormat: Whether to write one JSON object per record instead of plain text
+    :type jsonFormat: bool
+
+    :param stream: Stream written to, defaults to sys.stderr
+    :type stream: io.TextIOBase
+
+    :param filename: If given, records are written to this file instead of a stream
+    :type filename: str
+
+    :param maxEventsPerInterval: See EventSampler. None disables sampling
+    :type maxEventsPerInterval: int
+
+    :param intervalSeconds: See EventSampler
+    :type intervalSeconds: float
+
+    :param sampleRate: See EventSampler
+    :type sampleRate: int
+
+    :param force: Reconfigure even if logging has already been configured, here or by the application (whose root
+    handlers are then removed and closed)
+    :type force: bool
+
+    :return: None
+    """
+    global QUEUE_LISTENER
+    global IS_CONFIGURED
+
+    with CONFIGURATION_LOCK:
+        # Like logging.basicConfig(), leave an application that already configured the root logger alone
+        if not force and (IS_CONFIGURED or logging.getLogger().handlers):
+            return
+
+        stopLogging()
+
+        if filename is not None:
+            outputHandler = logging.FileHandler(filename)
+        else:
+            outputHandler = logging.StreamHandler(stream or sys.stderr)
+        outputHandler.setFormatter(JsonFormatter() if jsonFormat else logging.Formatter(DEFAULT_FORMAT))
+
+        recordQueue = queue.SimpleQueue()
+        queueHandler = LazyQueueHandler(recordQueue)
+        if maxEventsPerInterval is not None:
+            queueHandler.addFilter(EventSampler(maxEventsPerInterval = maxEventsPerInterval,
+                                                intervalSeconds = intervalSeconds, sampleRate = sampleRate))
+
+        rootLogger = logging.getLogger()
+        for handler in list(rootLogger.handlers):
+            rootLogger.removeHandler(handler)
+            handler.close()
+        rootLogger.addHandler(queueHandler)
+        rootLogger.setLevel(level)
+
+        QUEUE_LISTENER = QueueListener(recordQueue, outputHandler, respect_handler_level = True)
+        QUEUE_LISTENER.start()
+        IS_CONFIGURED = True
+
+
+def getOutputHandlers():
+    """
+    :return: Handlers the background writer passes records to, empty if logging was not configured here
+    :rtype: [logging.Handler]
+    """
+    queueListener = QUEUE_LISTENER
+    if queueListener is None:
+        return []
+
+    return list(queueListener.handlers)
+
+
+def stopLogging():
+    """
+    Flushes the queue and stops the background writer. Registered to run at exit.
+    """
+    global QUEUE_LISTENER
+
+    if QUEUE_LISTENER is not None:
+        QUEUE_LISTENER.stop()
+        for handler in QUEUE_LISTENER.handlers:
+            handler.close()
+        QUEUE_LISTENER = None
+
+
+atexit.register(stopLogging)
@@ -1,6 +1,7 @@
 import logging
+from LoggingSetup import configureLogging
 
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+configureLogging()
 LOGGER = logging.getLogger()
 
 
@@ -22,6 +23,29 @@ def parseCitiesCSV(filename, hasHeader = False, state = None):
     are in string form (e.g. "1.2345,6.789")
     :rtype: {str : str}
     """
+    cities = parseCitiesCSVWithStatistics(filename = filename, hasHeader = hasHeader, state = state)
+
+    return {cityName: cityStatistics["coordinates"] for cityName, cityStatistics in cities.items()}
+
+
+def parseCitiesCSVWithStatistics(filename, hasHeader = False, state = None):
+    """
+    Same reader as parseCitiesCSV(), but keeps the rank, state and population columns of the CSV alongside each city's
+    coordinates. These are used by the QueryScheduler to decide which epicentres should be searched first.
+
+    :param filename: Address of the CSV file to be read
+    :type filename: str
+
+    :param hasHeader: Whether CSV file has a header or not
+    :type hasHeader: bool
+
+    :param state: Specific state being considered for testing purposes
+    :type state: str
+
+    :return: Dictionary of form {cityName : {"coordinates" : str, "rank" : int, "state" : str, "population" : int}}.
+    Rank or population are None if they could not be read
+    :rtype: {str : {str : object}}
+    """
 
     if filename is None:
         LOGGER.error("filename is null")
@@ -34,7 +58,7 @@ def parseCitiesCSV(filename, hasHeader = False, state = None):
     cities = {}
 
     with open(filename, 'r') as file:
-        LOGGER.debug(filename + " OPENED SUCCESSFULLY")
+        LOGGER.debug("%s OPENED SUCCESSFULLY", filename)
         if hasHeader:
             file.readline()
 
@@ -45,14 +69,33 @@ def parseCitiesCSV(filename, hasHeader = False, state = None):
                 # Should not happen but just in case
                 continue
 
-            if state:
-                if line[2] == state:
-                    cityName = line[0]
-                    cities[cityName] = line[5]
-            else:
-                cityName = line[0]
-                cities[cityName] = line[5]
+            if state and line[2] != state:
+                continue
+
+            cityName = line[0]
+            cities[cityName] = {
+                "coordinates": line[5],
+                "rank": parseIntegerField(line[1]),
+                "state": line[2],
+                "population": parseIntegerField(line[4]),
+            }
 
-    LOGGER.debug(filename + " READ AND CLOSED SUCCESSFULLY")
+    LOGGER.debug("%s READ AND CLOSED SUCCESSFULLY", filename)
 
     return cities
+
+
+def parseIntegerField(field):
+    """
+    Converts a numeric CSV field into an integer, returning None if the field is blank or malformed
+
+    :param field: Field to be converted
+    :type field: str
+
+    :rtype: int
+    """
+    try:
+        return int(field)
+    except ValueError:
+        LOGGER.warning("Could not read integer field: %s", field)
+        return None
@@ -5,6 +5,7 @@ from pyspark.sql import SQLContext
 from pyspark.sql.functions import length, explode, split, concat_ws, rand
 from pyspark.sql import SparkSession
 from pyspark.ml.feature import StopWordsRemover
+from LoggingSetup import configureLogging
 
 """
         This was my pre-processing pipeline. I chose to use Apache Spark, but this isn't necessary if the amount of data
@@ -19,7 +20,7 @@ from pyspark.ml.feature import StopWordsRemover
                         - S.R.C.
 """
 
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+configureLogging()
 
 LOGGER = logging.getLogger()
 REMOVE_LIST = "., -"
@@ -81,7 +82,7 @@ def filterNullEntries(dataFrame, columnName):
         """
 
     if columnName not in dataFrame.columns:
-        LOGGER.error(columnName + " does not exist in data frame!")
+        LOGGER.error("%s does not exist in data frame!", columnName)
         raise ValueError
 
     dataFrame = dataFrame.where(dataFrame[columnName] != 'Undefined')
@@ -1,7 +1,8 @@
 import logging
 from jsonConvertToDict import convertObjectToDictionary
+from LoggingSetup import configureLogging
 
-logging.basicConfig(level = logging.DEBUG, format = '%(asctime)s - %(levelname)s - %(message)s')
+configureLogging()
 LOGGER = logging.getLogger()
 
 
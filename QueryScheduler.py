@@ -0,0 +1,299 @@
+import heapq
+import logging
+from enum import Enum
+from LoggingSetup import configureLogging
+
+configureLogging()
+LOGGER = logging.getLogger()
+
+
+class EpicentreOrder(Enum):
+    """
+    Used for a more descriptive way of identifying how the QueryScheduler should prioritise its queries
+    """
+    CSV_ORDER = 0   # Epicentres are visited in the order they were read
+    POPULATION = 1  # Largest cities first, every company is searched in a city before moving on
+    RANK = 2        # Same as POPULATION, but using the CSV's rank column
+    YIELD = 3       # Companies with the best hit rate get the largest remaining cities first
+
+
+class CompanyStatistics:
+    """
+    Keeps track of how often searches for a given company have turned up new locations. The hit rate is smoothed
+    towards a prior so that a company is not written off (or favoured) after a single query.
+    """
+
+    def __init__(self, companyName, priorHitRate = 0.5, priorWeight = 2.0):
+        """
+        :param companyName: Name of the company being tracked
+        :type companyName: str
+
+        :param priorHitRate: Hit rate assumed before any query has been made
+        :type priorHitRate: float
+
+        :param priorWeight: How many queries' worth of evidence the prior is worth
+        :type priorWeight: float
+        """
+        self.companyName = companyName
+        self.priorHitRate = priorHitRate
+        self.priorWeight = priorWeight
+        self.amountOfQueries = 0
+        self.amountOfHits = 0
+        self.amountOfResults = 0
+        self.consecutiveMisses = 0
+        self.nextEpicentreIndex = 0
+
+    def getHitRate(self):
+        """
+        :return: Smoothed fraction of epicentres in which this company returned new locations
+        :rtype: float
+        """
+        return (self.amountOfHits + self.priorHitRate * self.priorWeight) / (self.amountOfQueries + self.priorWeight)
+
+    def recordResult(self, amountOfNewResults):
+        """
+        :param amountOfNewResults: Amount of new locations found in the last epicentre searched
+        :type amountOfNewResults: int
+        """
+        self.amountOfQueries += 1
+        self.amountOfResults += amountOfNewResults
+
+        if amountOfNewResults > 0:
+            self.amountOfHits += 1
+            self.consecutiveMisses = 0
+        else:
+            self.consecutiveMisses += 1
+
+
+class QueryScheduler:
+    """
+    Decides which (epicentre, company) pair should be queried next. Epicentres are ordered by population (or rank) so
+    that the quota is spent in the largest cities first, and companies that come back empty for too many epicentres in
+    a row are deprioritised. Deprioritised companies are only searched again while there is exploration budget left;
+    a hit during exploration puts them back into the main queue.
+
+    Usage:
+        for city, epicentre, companyName in scheduler:
+            ...
+            scheduler.recordResult(companyName, amountOfNewResults)
+    """
+
+    def __init__(self, companyNameList, epicentres, epicentreOrder = EpicentreOrder.POPULATION,
+                 limitOfAmountOfCities = None, maxConsecutiveMisses = 5, explorationBudget = 0,
+                 explorationInterval = 10, priorHitRate = 0.5):
+        """
+        :param companyNameList: A list of names of companies to be searched
+        :type companyNameList: [str]
+
+        :param epicentres: Either the output of parseCitiesCSVWithStatistics() or a plain {cityName : coordinates}
+        dictionary, in which case every city is treated as having the same population
+        :type epicentres: {str : {str : object}} or {str : str}
+
+        :param epicentreOrder: How queries should be prioritised
+        :type epicentreOrder: EpicentreOrder
+
+        :param limitOfAmountOfCities: Optional limit of amount of cities to be searched, applied after ordering
+        :type limitOfAmountOfCities: int
+
+        :param maxConsecutiveMisses: Amount of empty epicentres in a row after which a company is deprioritised. None
+        disables early stopping
+        :type maxConsecutiveMisses: int
+
+        :param explorationBudget: Amount of queries that may be spent on deprioritised companies
+        :type explorationBudget: int
+
+        :param explorationInterval: Every this many scheduled queries, one is spent on exploration if budget remains
+        :type explorationInterval: int
+
+        :param priorHitRate: Hit rate assumed for a company before any of its queries have returned
+        :type priorHitRate: float
+        """
+        if companyNameList is None or epicentres is None:
+            LOGGER.error("Company name list or epicentres are null")
+            raise TypeError
+
+        if maxConsecutiveMisses is not None and maxConsecutiveMisses < 1:
+            LOGGER.error("maxConsecutiveMisses must be at least 1")
+            raise ValueError
+
+        self.epicentreOrder = epicentreOrder
+        self.maxConsecutiveMisses = maxConsecutiveMisses
+        self.explorationBudget = explorationBudget
+        self.explorationInterval = max(1, explorationInterval)
+        self.epicentreList = self.orderEpicentres(epicentres, epicentreOrder)
+
+        if limitOfAmountOfCities is not None:
+            self.epicentreList = self.epicentreList[:limitOfAmountOfCities]
+
+        largestPopulation = max([population for _, _, population in self.epicentreList if population] or [1])
+        self.populationWeights = [(population or largestPopulation) / largestPopulation
+                                  for _, _, population in self.epicentreList]
+
+        self.companyStatistics = {}
+        self.activeQueue = []
+        self.explorationPool = []
+        self.pendingCompanyName = None
+        self.amountOfScheduledQueries = 0
+        self.amountOfExplorationQueries = 0
+
+        for companyIndex, companyName in enumerate(companyNameList):
+            if companyName in self.companyStatistics:
+                continue
+
+            self.companyStatistics[companyName] = CompanyStatistics(companyName, priorHitRate = priorHitRate)
+            self.pushActive(companyName, companyIndex)
+
+    @staticmethod
+    def orderEpicentres(epicentres, epicentreOrder):
+        """
+        :return: List of (cityName, coordinates, population) tuples in the order they should be searched
+        :rtype: [(str, str, int)]
+        """
+        epicentreList = []
+        for cityName, cityInformation in epicentres.items():
+            if isinstance(cityInformation, dict):
+                epicentreList.append((cityName, cityInformation["coordinates"], cityInformation.get("population"),
+                                      cityInformation.get("rank")))
+            else:
+                epicentreList.append((cityName, cityInformation, None, None))
+
+        if epicentreOrder == EpicentreOrder.RANK:
+            epicentreList.sort(key = lambda epicentre: float("inf") if epicentre[3] is None else epicentre[3])
+        elif epicentreOrder != EpicentreOrder.CSV_ORDER:
+            epicentreList.sort(key = lambda epicentre: -(epicentre[2] or 0))
+
+        return [(cityName, coordinates, population) for cityName, coordinates, population, _ in epicentreList]
+
+    def getPriority(self, statistics, tieBreaker):
+        """
+        Heap key for a company's next query. Smaller keys are scheduled first.
+
+        :type statistics: CompanyStatistics
+        :type tieBreaker: int
+
+        :rtype: tuple
+        """
+        epicentreIndex = statistics.nextEpicentreIndex
+        hitRate = statistics.getHitRate()
+
+        if self.epicentreOrder == EpicentreOrder.YIELD:
+            return -hitRate * self.populationWeights[epicentreIndex], epicentreIndex, tieBreaker
+
+        return epicentreIndex, -hitRate, tieBreaker
+
+    def pushActive(self, companyName, tieBreaker = 0):
+        statistics = self.companyStatistics[companyName]
+
+        if statistics.nextEpicentreIndex >= len(self.epicentreList):
+            return
+
+        heapq.heappush(self.activeQueue, (self.getPriority(statistics, tieBreaker), companyName))
+
+    def popExploration(self):
+        """
+        :return: The deprioritised company with the best hit rate that still has epicentres left, or None
+        :rtype: str
+        """
+        self.explorationPool = [companyName for companyName in self.explorationPool
+                                if self.companyStatistics[companyName].nextEpicentreIndex < len(self.epicentreList)]
+
+        if not self.explorationPool:
+            return None
+
+        bestCompanyName = max(self.explorationPool, key = lambda name: self.companyStatistics[name].getHitRate())
+        self.explorationPool.remove(bestCompanyName)
+
+        return bestCompanyName
+
+    def getNextQuery(self):
+        """
+        :return: The next (cityName, epicentre, companyName) to be searched, or None if the schedule is exhausted
+        :rtype: (str, str, str)
+        """
+        if self.pendingCompanyName is not None:
+            LOGGER.warning("No result recorded for %s; counting it as a miss", self.pendingCompanyName)
+            self.recordResult(self.pendingCompanyName, 0)
+
+        companyName = None
+        canExplore = self.amountOfExplorationQueries < self.explorationBudget
+        isExplorationTurn = (self.amountOfScheduledQueries + 1) % self.explorationInterval == 0
+
+        if canExplore and (isExplorationTurn or not self.activeQueue):
+            companyName = self.popExploration()
+            if companyName is not None:
+                self.amountOfExplorationQueries += 1
+
+        if companyName is None:
+            if not self.activeQueue:
+                return None
+            _, companyName = heapq.heappop(self.activeQueue)
+
+        statistics = self.companyStatistics[companyName]
+        cityName, epicentre, _ = self.epicentreList[statistics.nextEpicentreIndex]
+        statistics.nextEpicentreIndex += 1
+        self.amountOfScheduledQueries += 1
+        self.pendingCompanyName = companyName
+
+        return cityName, epicentre, companyName
+
+    def recordResult(self, companyName, amountOfNewResults):
+        """
+        Updates the company's hit rate and either requeues it or, after too many consecutive misses, moves it to the
+        exploration pool.
+
+        :param companyName: Company that was just searched
+        :type companyName: str
+
+        :param amountOfNewResults: Amount of new locations the search added
+        :type amountOfNewResults: int
+        """
+        if companyName not in self.companyStatistics:
+            LOGGER.error("Unknown company: %s", companyName)
+            raise ValueError
+
+        if companyName == self.pendingCompanyName:
+            self.pendingCompanyName = None
+
+        statistics = self.companyStatistics[companyName]
+        statistics.recordResult(amountOfNewResults)
+
+        if self.maxConsecutiveMisses is not None and statistics.consecutiveMisses >= self.maxConsecutiveMisses:
+            if statistics.consecutiveMisses == self.maxConsecutiveMisses:
+                LOGGER.info("Deprioritising %s after %d empty epicentres", companyName, statistics.consecutiveMisses)
+            self.explorationPool.append(companyName)
+        else:
+            self.pushActive(companyName, self.amountOfScheduledQueries)
+
+    def recordFailure(self, companyName):
+        """
+        Requeues a company whose last search failed without touching its statistics. The failed epicentre is not
+        rescheduled; the caller is expected to retry it.
+
+        :param companyName: Company whose search failed
+        :type companyName: str
+        """
+        if companyName not in self.companyStatistics:
+            LOGGER.error("Unknown company: %s", companyName)
+            raise ValueError
+
+        if companyName == self.pendingCompanyName:
+            self.pendingCompanyName = None
+
+        statistics = self.companyStatistics[companyName]
+        if self.maxConsecutiveMisses is not None and statistics.consecutiveMisses >= self.maxConsecutiveMisses:
+            self.explorationPool.append(companyName)
+        else:
+            self.pushActive(companyName, self.amountOfScheduledQueries)
+
+    def getCompanyStatistics(self):
+        """
+        :return: Dictionary of per-company statistics gathered so far
+        :rtype: {str : CompanyStatistics}
+        """
+        return self.companyStatistics
+
+    def __iter__(self):
+        nextQuery = self.getNextQuery()
+        while nextQuery is not None:
+            yield nextQuery
+            nextQuery = self.getNextQuery()
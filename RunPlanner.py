@@ -0,0 +1,286 @@
+import os
+import json
+import logging
+from itertools import islice
+from LoggingSetup import configureLogging
+
+configureLogging()
+LOGGER = logging.getLogger()
+
+"""
+Dry-run planning for a crawl. Before any request is sent, planCompanyLocationsRun() works out how many Places API calls
+a run of getCompanyLocationsNearLocationList() (or, given sweepsPerCity, of getCompanyLocationsBySweep()) would make,
+what they would cost and how long they would take, using the statistics GooglePlacesSEB collects (QUERY_STATISTICS)
+from earlier runs where available.
+
+The two modes have very different rates (a sweep page is usually full, a company search rarely is), so their
+statistics should be kept in separate history files.
+"""
+
+# USD per call. These are the list prices the API was priced at when this was written; check the current pricing page
+# before relying on the cost estimate.
+SKU_PRICES = {
+    "nearbySearch": 32.0 / 1000,
+    "placeDetails": 17.0 / 1000,
+}
+MAX_RADIUS_OF_SEARCH = 50000  # metres, the most places_nearby() accepts
+
+# Used when no historical statistics are available
+DEFAULT_RESULTS_PER_NEARBY_CALL = 20.0   # a full page
+DEFAULT_DETAIL_CALLS_PER_NEARBY_CALL = 1.0
+DEFAULT_ACCEPTED_RESULTS_PER_DETAIL_CALL = 0.5
+DEFAULT_NEARBY_LATENCY = 0.5  # seconds
+DEFAULT_DETAIL_LATENCY = 0.3  # seconds
+
+
+def getEmptyQueryStatistics():
+    """
+    :return: Counters of the form kept by GooglePlacesSEB.QUERY_STATISTICS
+    :rtype: {str : float}
+    """
+    return {
+        "nearbyCalls": 0,
+        "nearbyResults": 0,
+        "nearbySeconds": 0.0,
+        "detailCalls": 0,
+        "detailHedges": 0,  # Hedged duplicates of detail calls (see LatencyGuard), billed on top of detailCalls
+        "detailSeconds": 0.0,
+        "acceptedResults": 0,
+    }
+
+
+def saveQueryStatistics(queryStatistics, filename):
+    """
+    Appends one run's statistics to a history file (one JSON object per line)
+
+    :param queryStatistics: Statistics collected during the run (see GooglePlacesSEB.QUERY_STATISTICS)
+    :type queryStatistics: {str : float}
+
+    :param filename: Address of the history file
+    :type filename: str
+    """
+    if filename is None:
+        LOGGER.error("filename is null")
+        raise TypeError
+
+    with open(filename, 'a') as file:
+        print(json.dumps(queryStatistics), file = file)
+
+
+def loadQueryStatistics(filename):
+    """
+    Reads a history file written by saveQueryStatistics() and adds the runs up
+
+    :param filename: Address of the history file
+    :type filename: str
+
+    :return: Summed statistics, or None if the file does not exist or holds no runs
+    :rtype: {str : float}
+    """
+    if filename is None or not os.path.exists(filename):
+        return None
+
+    totalStatistics = getEmptyQueryStatistics()
+    amountOfRuns = 0
+
+    with open(filename, 'r') as file:
+        for line in file:
+            if not line.strip():
+                continue
+
+            runStatistics = json.loads(line)
+            for statisticName in totalStatistics:
+                totalStatistics[statisticName] += runStatistics.get(statisticName, 0)
+            amountOfRuns += 1
+
+    return totalStatistics if amountOfRuns > 0 else None
+
+
+def getAmountOfCitiesSearched(amountOfCities, limitOfAmountOfCities):
+    """
+    Every pipeline searches the first limitOfAmountOfCities cities, or every city if there is no limit
+
+    :rtype: int
+    """
+    if limitOfAmountOfCities is None:
+        return amountOfCities
+
+    return min(amountOfCities, limitOfAmountOfCities)
+
+
+class ExecutionPlan:
+    """
+    Expected size, cost and duration of a run, along with any warnings raised while planning it
+    """
+
+    def __init__(self, amountOfCompanies, plannedCities, radiusFromEpicentre, expectedNearbyCalls,
+                 expectedDetailCalls, expectedResults, estimatedCost, projectedSeconds, isHistorical,
+                 sweepsPerCity = None):
+        self.amountOfCompanies = amountOfCompanies
+        self.plannedCities = plannedCities
+        self.amountOfCities = len(plannedCities)
+        self.radiusFromEpicentre = radiusFromEpicentre
+        self.expectedNearbyCalls = expectedNearbyCalls
+        self.expectedDetailCalls = expectedDetailCalls
+        self.expectedResults = expectedResults
+        self.estimatedCost = estimatedCost
+        self.projectedSeconds = projectedSeconds
+        self.isHistorical = isHistorical
+        self.sweepsPerCity = sweepsPerCity
+        self.warnings = []
+
+    def getTotalCalls(self):
+        return self.expectedNearbyCalls + self.expectedDetailCalls
+
+    def getTotalCost(self):
+        return sum(self.estimatedCost.values())
+
+    def addWarning(self, warning):
+        LOGGER.warning(warning)
+        self.warnings.append(warning)
+
+    def __str__(self):
+        stringRep = "MODE: " + ("per company" if self.sweepsPerCity is None else
+                                str(self.sweepsPerCity) + " sweeps per city") + \
+                    "\nCOMPANIES: " + str(self.amountOfCompanies) + "\nCITIES: " + str(self.amountOfCities) + \
+                    "\nRADIUS: " + str(self.radiusFromEpicentre) + " m" + \
+                    "\nNEARBY CALLS: " + str(self.expectedNearbyCalls) + \
+                    "\nDETAIL CALLS: " + str(round(self.expectedDetailCalls)) + \
+                    "\nEXPECTED RESULTS: " + str(round(self.expectedResults)) + \
+                    "\nESTIMATED COST: $" + "%.2f" % self.getTotalCost() + " (" + \
+                    ", ".join(sku + ": $" + "%.2f" % cost for sku, cost in self.estimatedCost.items()) + ")" + \
+                    "\nPROJECTED WALL TIME: " + "%.1f" % (self.projectedSeconds / 60) + " minutes" + \
+                    "\nRATES FROM: " + ("earlier runs" if self.isHistorical else "defaults") + "\n"
+
+        for warning in self.warnings:
+            stringRep += "WARNING: " + warning + "\n"
+
+        return stringRep
+
+
+def planCompanyLocationsRun(companyNameList, locationsDictionary, radiusFromEpicentre = MAX_RADIUS_OF_SEARCH,
+                            limitOfAmountOfCities = 50, historicalStatistics = None, concurrency = 1,
+                            queriesPerSecond = 60, dailyQuota = None, dailyBudget = None, sweepsPerCity = None,
+                            pagesPerSweep = 3, pageTokenDelay = 2.0):
+    """
+    Estimates what getCompanyLocationsNearLocationList() would do with the same arguments, without calling the API.
+    If sweepsPerCity is given, estimates getCompanyLocationsBySweep() instead.
+
+    Every company is searched once per city (places_nearby() is not paginated), or, in sweep mode, every city is swept
+    sweepsPerCity times with up to pagesPerSweep pages each (the estimate assumes every page is requested). Every
+    nearby result that passes the fuzzy string filter costs a place() call, plus the hedged duplicates of slow place()
+    calls. The rate of those, and the latency of both calls, are taken from
+    historicalStatistics if given, otherwise from the DEFAULT_* constants above. Wall time assumes `concurrency` calls
+    in flight, capped by `queriesPerSecond`.
+
+    :param companyNameList: A list of names of companies to be searched
+    :type companyNameList: [str]
+
+    :param locationsDictionary: A set of City names and epicentre coordinates to be searched (see parseCitiesCSV())
+    :type locationsDictionary: {str : str}
+
+    :param radiusFromEpicentre: Radius of search centered at every epicentre
+    :type radiusFromEpicentre: float
+
+    :param limitOfAmountOfCities: Optional limit of amount of cities to be searched
+    :type limitOfAmountOfCities: int
+
+    :param historicalStatistics: Summed statistics of earlier runs (see loadQueryStatistics())
+    :type historicalStatistics: {str : float}
+
+    :param concurrency: Amount of requests in flight at once
+    :type concurrency: int
+
+    :param queriesPerSecond: Client-side rate limit
+    :type queriesPerSecond: float
+
+    :param dailyQuota: Optional amount of calls allowed per day
+    :type dailyQuota: int
+
+    :param dailyBudget: Optional amount of USD allowed per day
+    :type dailyBudget: float
+
+    :param sweepsPerCity: Amount of sweeps (keywords and types) per city, if planning a sweep-mode run
+    :type sweepsPerCity: int
+
+    :param pagesPerSweep: Maximum amount of pages requested per sweep
+    :type pagesPerSweep: int
+
+    :param pageTokenDelay: Seconds waited before every page after the first
+    :type pageTokenDelay: float
+
+    :rtype: ExecutionPlan
+    """
+    if companyNameList is None or locationsDictionary is None:
+        LOGGER.error("Company name list or locations dictionary is null")
+        raise TypeError
+
+    amountOfCompanies = len(set(companyNameList))
+    plannedCities = list(islice(locationsDictionary, getAmountOfCitiesSearched(len(locationsDictionary),
+                                                                               limitOfAmountOfCities)))
+    amountOfCities = len(plannedCities)
+
+    isHistorical = bool(historicalStatistics) and historicalStatistics.get("nearbyCalls", 0) > 0
+    if isHistorical:
+        nearbyCalls = historicalStatistics["nearbyCalls"]
+        detailCalls = historicalStatistics.get("detailCalls", 0)
+        resultsPerNearbyCall = historicalStatistics.get("nearbyResults", 0) / nearbyCalls
+        detailCallsPerNearbyCall = detailCalls / nearbyCalls
+        acceptedResultsPerDetailCall = (historicalStatistics.get("acceptedResults", 0) / detailCalls
+                                        if detailCalls else DEFAULT_ACCEPTED_RESULTS_PER_DETAIL_CALL)
+        hedgesPerDetailCall = historicalStatistics.get("detailHedges", 0) / detailCalls if detailCalls else 0.0
+        nearbyLatency = historicalStatistics.get("nearbySeconds", 0.0) / nearbyCalls or DEFAULT_NEARBY_LATENCY
+        detailLatency = (historicalStatistics.get("detailSeconds", 0.0) / detailCalls
+                         if detailCalls else DEFAULT_DETAIL_LATENCY)
+    else:
+        resultsPerNearbyCall = DEFAULT_RESULTS_PER_NEARBY_CALL
+        detailCallsPerNearbyCall = DEFAULT_DETAIL_CALLS_PER_NEARBY_CALL
+        acceptedResultsPerDetailCall = DEFAULT_ACCEPTED_RESULTS_PER_DETAIL_CALL
+        hedgesPerDetailCall = 0.0
+        nearbyLatency = DEFAULT_NEARBY_LATENCY
+        detailLatency = DEFAULT_DETAIL_LATENCY
+
+    if sweepsPerCity is None:
+        expectedNearbyCalls = amountOfCompanies * amountOfCities
+        paginationSeconds = 0.0
+    else:
+        expectedNearbyCalls = amountOfCities * sweepsPerCity * pagesPerSweep
+        # Sweeps are run one after the other, and so are the waits for their page tokens
+        paginationSeconds = amountOfCities * sweepsPerCity * max(0, pagesPerSweep - 1) * pageTokenDelay
+    expectedLogicalDetailCalls = min(expectedNearbyCalls * detailCallsPerNearbyCall,
+                                     expectedNearbyCalls * resultsPerNearbyCall)
+    expectedDetailCalls = expectedLogicalDetailCalls * (1.0 + hedgesPerDetailCall)  # as billed
+    expectedResults = expectedLogicalDetailCalls * acceptedResultsPerDetailCall
+    estimatedCost = {
+        "nearbySearch": expectedNearbyCalls * SKU_PRICES["nearbySearch"],
+        "placeDetails": expectedDetailCalls * SKU_PRICES["placeDetails"],
+    }
+
+    # Calls are bound either by how many can be waited on at once or by the rate limit, whichever is slower
+    latencyBoundSeconds = (expectedNearbyCalls * nearbyLatency + expectedLogicalDetailCalls * detailLatency) / \
+        max(1, concurrency)
+    rateBoundSeconds = (expectedNearbyCalls + expectedDetailCalls) / queriesPerSecond if queriesPerSecond else 0.0
+    projectedSeconds = max(latencyBoundSeconds, rateBoundSeconds) + paginationSeconds
+
+    plan = ExecutionPlan(amountOfCompanies = amountOfCompanies, plannedCities = plannedCities,
+                         radiusFromEpicentre = radiusFromEpicentre, expectedNearbyCalls = expectedNearbyCalls,
+                         expectedDetailCalls = expectedDetailCalls, expectedResults = expectedResults,
+                         estimatedCost = estimatedCost, projectedSeconds = projectedSeconds,
+                         isHistorical = isHistorical, sweepsPerCity = sweepsPerCity)
+
+    if radiusFromEpicentre > MAX_RADIUS_OF_SEARCH:
+        plan.addWarning("Radius of " + str(radiusFromEpicentre) + " m exceeds the API maximum of " +
+                        str(MAX_RADIUS_OF_SEARCH) + " m")
+
+    if dailyQuota is not None and plan.getTotalCalls() > dailyQuota:
+        plan.addWarning("Plan needs about " + str(round(plan.getTotalCalls())) + " calls, over the daily quota of " +
+                        str(dailyQuota))
+
+    if dailyBudget is not None and plan.getTotalCost() > dailyBudget:
+        plan.addWarning("Plan costs about $" + "%.2f" % plan.getTotalCost() + ", over the daily budget of $" +
+                        "%.2f" % dailyBudget)
+
+    if not isHistorical:
+        plan.addWarning("No statistics from earlier runs, detail calls and latencies are rough defaults")
+
+    return plan
@@ -0,0 +1,268 @@
+import os
+import sys
+import time
+import pstats
+import cProfile
+import logging
+import threading
+import tracemalloc
+from collections import Counter, defaultdict
+from LoggingSetup import configureLogging, getOutputHandlers
+
+configureLogging()
+LOGGER = logging.getLogger()
+
+"""
+Opt-in profiling for a run of the pipeline. Every switch is off by default, in which case RunProfiler does nothing when
+entered, and markStage() returns immediately. The available outputs, all written to outputDirectory, are:
+
+    <runName>.pstats / <runName>.pstats.txt  cProfile dump (load with pstats or snakeviz) and a cumulative-time summary
+    <runName>.memory.txt                     tracemalloc snapshots taken at every stage boundary, diffed stage to stage
+                                             (each diff is written when its stage ends, and only the latest snapshot
+                                             is kept, so long runs with many stages stay bounded in memory)
+    <runName>.folded                         Collapsed stacks from a sampling thread, in the format flamegraph.pl and
+                                             speedscope read (same as py-spy record --format raw)
+    <runName>.logging.txt                    Amount of log records kept (i.e. not dropped by the sampler) and time spent
+                                             in logging handlers per call site, both in the logging threads (filtering
+                                             and queueing) and in the background writer (formatting and I/O), to tell
+                                             how much the DEBUG logging set up in every module costs
+"""
+
+PSTATS_SUMMARY_LENGTH = 50
+MEMORY_SUMMARY_LENGTH = 20
+
+
+class RunProfiler:
+    """
+    Context manager that wraps a run and collects whichever profiles were switched on.
+
+    Usage:
+        with RunProfiler("profiles", enableCProfile = True, enableTracemalloc = True) as profiler:
+            companyLocationsMaster = getCompanyLocationsNearLocationList(..., profiler = profiler)
+    """
+
+    def __init__(self, outputDirectory = ".", runName = None, enableCProfile = False, enableTracemalloc = False,
+                 enableSampling = False, enableLoggingProfile = False, samplingInterval = 0.005,
+                 tracemallocFrames = 1):
+        """
+        :param outputDirectory: Directory the profiles are written to
+        :type outputDirectory: str
+
+        :param runName: Prefix of the output files, defaults to "run_<timestamp>"
+        :type runName: str
+
+        :param enableCProfile: Whether to run cProfile for the whole run
+        :type enableCProfile: bool
+
+        :param enableTracemalloc: Whether to take tracemalloc snapshots at stage boundaries
+        :type enableTracemalloc: bool
+
+        :param enableSampling: Whether to sample the run's call stack for a flamegraph
+        :type enableSampling: bool
+
+        :param enableLoggingProfile: Whether to count and time log records per call site
+        :type enableLoggingProfile: bool
+
+        :param samplingInterval: Seconds between two stack samples
+        :type samplingInterval: float
+
+        :param tracemallocFrames: Amount of frames tracemalloc keeps per allocation
+        :type tracemallocFrames: int
+        """
+        self.outputDirectory = outputDirectory
+        self.runName = runName or time.strftime("run_%Y%m%d_%H%M%S")
+        self.enableCProfile = enableCProfile
+        self.enableTracemalloc = enableTracemalloc
+        self.enableSampling = enableSampling
+        self.enableLoggingProfile = enableLoggingProfile
+        self.samplingInterval = samplingInterval
+        self.tracemallocFrames = tracemallocFrames
+        self.isEnabled = enableCProfile or enableTracemalloc or enableSampling or enableLoggingProfile
+
+        self.profile = None
+        self.previousSnapshot = None
+        self.isTracingStartedHere = False
+        self.samplingThread = None
+        self.stopSampling = threading.Event()
+        self.stackCounts = Counter()
+        self.originalHandleMethods = {}
+        self.logRecordCounts = Counter()
+        self.logCallerSeconds = defaultdict(float)
+        self.logWriterSeconds = defaultdict(float)
+        self.loggingProfileLock = threading.Lock()
+
+    def getOutputPath(self, suffix):
+        return os.path.join(self.outputDirectory, self.runName + suffix)
+
+    def start(self):
+        if not self.isEnabled:
+            return
+
+        os.makedirs(self.outputDirectory, exist_ok = True)
+
+        if self.enableLoggingProfile:
+            self.startLoggingProfile()
+
+        if self.enableTracemalloc:
+            self.isTracingStartedHere = not tracemalloc.is_tracing()
+            if self.isTracingStartedHere:
+                tracemalloc.start(self.tracemallocFrames)
+            open(self.getOutputPath(".memory.txt"), "w").close()
+            self.previousSnapshot = tracemalloc.take_snapshot()
+
+        if self.enableSampling:
+            self.startSampling(threading.get_ident())
+
+        if self.enableCProfile:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+
+    def markStage(self, stageName):
+        """
+        Marks a stage boundary (e.g. a city or a tile finishing). Only does work if tracemalloc is switched on, in which
+        case the allocations made since the previous boundary are written out right away.
+
+        :param stageName: Name the snapshot diff is filed under
+        :type stageName: str
+        """
+        if self.enableTracemalloc and self.previousSnapshot is not None and tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot()
+            self.writeMemoryDiff(stageName, snapshot)
+            self.previousSnapshot = snapshot
+
+    def stop(self):
+        if not self.isEnabled:
+            return
+
+        if self.originalHandleMethods:
+            self.stopLoggingProfile()
+            self.writeLoggingProfile()
+
+        if self.profile is not None:
+            self.profile.disable()
+            self.writeCProfile()
+            self.profile = None
+
+        if self.samplingThread is not None:
+            self.stopSampling.set()
+            self.samplingThread.join()
+            self.samplingThread = None
+            self.writeFoldedStacks()
+
+        if self.previousSnapshot is not None:
+            self.markStage("end")
+            self.writeMemoryTotals()
+            self.previousSnapshot = None
+
+            if self.isTracingStartedHere:
+                tracemalloc.stop()
+                self.isTracingStartedHere = False
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exceptionType, exceptionValue, traceback):
+        self.stop()
+
+    def writeCProfile(self):
+        self.profile.dump_stats(self.getOutputPath(".pstats"))
+
+        with open(self.getOutputPath(".pstats.txt"), "w") as outputFile:
+            stats = pstats.Stats(self.profile, stream = outputFile)
+            stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(PSTATS_SUMMARY_LENGTH)
+
+        LOGGER.info("cProfile written to %s", self.getOutputPath(".pstats"))
+
+    def writeMemoryDiff(self, stageName, snapshot):
+        with open(self.getOutputPath(".memory.txt"), "a") as outputFile:
+            print("--- " + stageName + " ---", file = outputFile)
+            for statistic in snapshot.compare_to(self.previousSnapshot, "lineno")[:MEMORY_SUMMARY_LENGTH]:
+                print(statistic, file = outputFile)
+            print(file = outputFile)
+
+    def writeMemoryTotals(self):
+        with open(self.getOutputPath(".memory.txt"), "a") as outputFile:
+            current, peak = tracemalloc.get_traced_memory()
+            print("CURRENT: %d bytes, PEAK: %d bytes" % (current, peak), file = outputFile)
+
+        LOGGER.info("Memory snapshots written to %s", self.getOutputPath(".memory.txt"))
+
+    def startSampling(self, threadIdentifier):
+        self.stopSampling.clear()
+        self.samplingThread = threading.Thread(target = self.sampleStacks, args = (threadIdentifier,), daemon = True)
+        self.samplingThread.start()
+
+    def sampleStacks(self, threadIdentifier):
+        while not self.stopSampling.wait(self.samplingInterval):
+            frame = sys._current_frames().get(threadIdentifier)
+            stack = []
+
+            while frame is not None:
+                code = frame.f_code
+                stack.append("%s (%s:%d)" % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+                frame = frame.f_back
+
+            if stack:
+                self.stackCounts[";".join(reversed(stack))] += 1
+
+    def writeFoldedStacks(self):
+        with open(self.getOutputPath(".folded"), "w") as outputFile:
+            for stack, count in self.stackCounts.most_common():
+                print(stack + " " + str(count), file = outputFile)
+
+        LOGGER.info("Collapsed stacks written to %s", self.getOutputPath(".folded"))
+
+    def startLoggingProfile(self):
+        # Root handlers run on the logging thread; with LoggingSetup's queue, formatting and I/O happen in the handlers
+        # of its background writer instead, so those are timed too
+        for handler in logging.getLogger().handlers:
+            self.originalHandleMethods[handler] = handler.handle
+            handler.handle = self.makeTimedHandle(handler.handle, isWriter = False)
+
+        for handler in getOutputHandlers():
+            self.originalHandleMethods[handler] = handler.handle
+            handler.handle = self.makeTimedHandle(handler.handle, isWriter = True)
+
+    def makeTimedHandle(self, originalHandle, isWriter):
+        def timedHandle(record):
+            startTime = time.perf_counter()
+            isKept = False
+            try:
+                isKept = originalHandle(record)
+                return isKept
+            finally:
+                elapsedSeconds = time.perf_counter() - startTime
+                callSite = "%s %s:%d" % (record.levelname, record.module, record.lineno)
+
+                with self.loggingProfileLock:
+                    if isWriter:
+                        self.logWriterSeconds[callSite] += elapsedSeconds
+                    else:
+                        self.logCallerSeconds[callSite] += elapsedSeconds
+                        if isKept:
+                            self.logRecordCounts[callSite] += 1
+
+        return timedHandle
+
+    def stopLoggingProfile(self):
+        for handler, originalHandle in self.originalHandleMethods.items():
+            handler.handle = originalHandle
+
+        self.originalHandleMethods = {}
+
+    def writeLoggingProfile(self):
+        with open(self.getOutputPath(".logging.txt"), "w") as outputFile:
+            print("RECORDS: %d, SECONDS IN LOGGING THREADS: %.6f, SECONDS IN WRITER: %.6f" %
+                  (sum(self.logRecordCounts.values()), sum(self.logCallerSeconds.values()),
+                   sum(self.logWriterSeconds.values())), file = outputFile)
+            print("%8s %10s %10s %s" % ("RECORDS", "LOGGING", "WRITER", "CALL SITE"), file = outputFile)
+
+            callSites = sorted(set(self.logCallerSeconds) | set(self.logWriterSeconds),
+                               key = lambda callSite: -(self.logCallerSeconds[callSite] +
+                                                        self.logWriterSeconds[callSite]))
+            for callSite in callSites:
+                print("%8d %10.6f %10.6f %s" % (self.logRecordCounts[callSite], self.logCallerSeconds[callSite],
+                                                self.logWriterSeconds[callSite], callSite), file = outputFile)
+
+        LOGGER.info("Logging profile written to %s", self.getOutputPath(".logging.txt"))
@@ -0,0 +1,88 @@
+import logging
+import threading
+from LoggingSetup import configureLogging
+
+configureLogging()
+LOGGER = logging.getLogger()
+
+
+class InFlightCall:
+    """
+    A request being made on behalf of every caller that asked for the same key while it was running
+    """
+
+    def __init__(self):
+        self.isDone = threading.Event()
+        self.result = None
+        self.error = None
+        self.amountOfWaiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent requests. The first caller for a key makes the request; anyone asking for the same
+    key before it returns waits for it and gets the same result (or has the same error raised). Nothing is cached: once
+    the request returns, the next caller for that key makes a new one.
+
+    Shared results are the same object for every caller and must not be modified.
+    """
+
+    def __init__(self, name):
+        """
+        :param name: Name used in log messages
+        :type name: str
+        """
+        self.name = name
+        self.inFlightCalls = {}
+        self.lock = threading.Lock()
+        self.counters = {"calls": 0, "executed": 0, "collapsed": 0}
+
+    def call(self, key, function, *args, **kwargs):
+        """
+        Calls function(*args, **kwargs), unless a call for the same key is already in flight, in which case its outcome
+        is shared.
+
+        :param key: Canonical form of the request, must be hashable
+        :type key: tuple
+
+        :return: What function returned
+        """
+        with self.lock:
+            self.counters["calls"] += 1
+            inFlightCall = self.inFlightCalls.get(key)
+
+            if inFlightCall is None:
+                inFlightCall = InFlightCall()
+                self.inFlightCalls[key] = inFlightCall
+                self.counters["executed"] += 1
+                isLeader = True
+            else:
+                inFlightCall.amountOfWaiters += 1
+                self.counters["collapsed"] += 1
+                isLeader = False
+
+        if not isLeader:
+            LOGGER.debug("%s: joining in-flight request %s", self.name, key)
+            inFlightCall.isDone.wait()
+            if inFlightCall.error is not None:
+                raise inFlightCall.error
+            return inFlightCall.result
+
+        try:
+            inFlightCall.result = function(*args, **kwargs)
+            return inFlightCall.result
+        except BaseException as e:
+            inFlightCall.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.inFlightCalls[key]
+            inFlightCall.isDone.set()
+
+    def getCounters(self):
+        """
+        :return: Amount of calls made to this group, how many actually ran, and how many were collapsed into another
+        :rtype: {str : int}
+        """
+        with self.lock:
+            return dict(self.counters)
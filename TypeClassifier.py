@@ -0,0 +1,315 @@
+import json
+import logging
+import numpy as np
+from LoggingSetup import configureLogging
+
+configureLogging()
+LOGGER = logging.getLogger()
+
+"""
+Type-based filtering of query results. Every type mentioned by a rule is given an integer ID, rules are compiled into
+bitmasks over those IDs, and a batch of results is encoded into one bitmask per result, so that a whole batch is
+checked against a rule with a handful of array operations.
+
+Rules are resolved per company: a company's own rule set if it has one, otherwise its sector's, otherwise the default.
+A company's sector is the one listed for it in companySectors or, failing that, the sector of the run (e.g. the sector
+the company sample was selected by). Rule sets are loaded from a JSON file of the form
+
+{
+    "default": {"deny": ["bar", "cafe", ...]},
+    "sectors": {
+        "Materials": {"allow": ["store"], "deny": ["car_dealer"], "require": []}
+    },
+    "companySectors": {"vulcan materials": "Materials"},
+    "companies": {
+        "martin marietta": {"deny": ["finance"], "inheritDeny": false}
+    }
+}
+
+where, for a rule set:
+    deny         Results with any of these types are rejected
+    allow        Types exempted from the inherited deny list
+    require      If not empty, results must have at least one of these types. If not given, the require list of the
+                 sector (for companies), else the default's, is inherited
+    inheritDeny  Whether the deny list of the sector (for companies) and the default is inherited, true by default
+"""
+
+ACCEPTED = "ACCEPTED"
+DENIED_TYPE = "DENIED_TYPE"
+MISSING_REQUIRED_TYPE = "MISSING_REQUIRED_TYPE"
+BITS_PER_WORD = 64
+
+
+def normaliseCompanyName(companyName):
+    """
+    Company keywords are quoted for the API (see PySparkPreprocessing.addDoubleQuotes()); rules are keyed without quotes
+
+    :rtype: str
+    """
+    return " ".join(companyName.replace('"', '').lower().split())
+
+
+class TypeVocabulary:
+    """
+    Assigns every known type a bit position. Types a rule never mentions are not given one, since they cannot change
+    the outcome of any rule.
+    """
+
+    def __init__(self, types = None):
+        self.typeIDs = {}
+        self.typeNames = []
+
+        for typeName in types or []:
+            self.addType(typeName)
+
+    def addType(self, typeName):
+        if typeName not in self.typeIDs:
+            self.typeIDs[typeName] = len(self.typeNames)
+            self.typeNames.append(typeName)
+
+        return self.typeIDs[typeName]
+
+    def getAmountOfWords(self):
+        return max(1, (len(self.typeNames) + BITS_PER_WORD - 1) // BITS_PER_WORD)
+
+    def encodeTypes(self, types):
+        """
+        :param types: Type names
+        :type types: [str]
+
+        :return: Bitmask of the known types among them
+        :rtype: numpy.ndarray
+        """
+        return self.encodeBatch([types])[0]
+
+    def encodeBatch(self, typesBatch):
+        """
+        :param typesBatch: One list of type names per result
+        :type typesBatch: [[str]]
+
+        :return: Array of shape (amountOfResults, amountOfWords)
+        :rtype: numpy.ndarray
+        """
+        masks = np.zeros((len(typesBatch), self.getAmountOfWords()), dtype = np.uint64)
+
+        for rowIndex, types in enumerate(typesBatch):
+            for typeName in types or []:
+                typeID = self.typeIDs.get(typeName)
+                if typeID is not None:
+                    masks[rowIndex, typeID // BITS_PER_WORD] |= np.uint64(1) << np.uint64(typeID % BITS_PER_WORD)
+
+        return masks
+
+    def decodeFirstType(self, mask):
+        """
+        :return: Name of the lowest type set in the mask, or None
+        :rtype: str
+        """
+        for wordIndex, word in enumerate(mask.tolist()):
+            if word:
+                return self.typeNames[wordIndex * BITS_PER_WORD + (word & -word).bit_length() - 1]
+
+        return None
+
+
+class TypeRuleSet:
+    """
+    A deny mask and an optional require mask, compiled against a TypeVocabulary
+    """
+
+    def __init__(self, name, vocabulary, denyTypes = None, requireTypes = None):
+        """
+        :param name: Name reported along with rejections (e.g. "default", "sector:Materials")
+        :type name: str
+
+        :type vocabulary: TypeVocabulary
+
+        :param denyTypes: Results with any of these types are rejected
+        :type denyTypes: [str]
+
+        :param requireTypes: If not empty, results must have at least one of these types
+        :type requireTypes: [str]
+        """
+        self.name = name
+        self.vocabulary = vocabulary
+        self.denyTypes = sorted(set(denyTypes or []))
+        self.requireTypes = sorted(set(requireTypes or []))
+        self.denyMask = vocabulary.encodeTypes(self.denyTypes)
+        self.requireMask = vocabulary.encodeTypes(self.requireTypes) if self.requireTypes else None
+
+    def classifyMasks(self, masks):
+        """
+        :param masks: Encoded results (see TypeVocabulary.encodeBatch())
+        :type masks: numpy.ndarray
+
+        :return: Whether each result is accepted, and a reason for each result
+        :rtype: (numpy.ndarray, [str])
+        """
+        deniedMasks = masks & self.denyMask
+        isDenied = deniedMasks.any(axis = 1)
+        isMissingRequired = np.zeros(len(masks), dtype = bool)
+        if self.requireMask is not None:
+            isMissingRequired = ~(masks & self.requireMask).any(axis = 1)
+
+        isAccepted = ~(isDenied | isMissingRequired)
+        reasons = [ACCEPTED] * len(masks)
+
+        for rowIndex in np.flatnonzero(isDenied):
+            reasons[rowIndex] = DENIED_TYPE + ":" + self.vocabulary.decodeFirstType(deniedMasks[rowIndex]) + \
+                                " (" + self.name + ")"
+        for rowIndex in np.flatnonzero(isMissingRequired & ~isDenied):
+            reasons[rowIndex] = MISSING_REQUIRED_TYPE + " (" + self.name + ")"
+
+        return isAccepted, reasons
+
+
+class TypeClassifier:
+    """
+    Holds the compiled rule sets and picks the right one for every company
+    """
+
+    def __init__(self, defaultDenyTypes = None, ruleConfiguration = None):
+        """
+        :param defaultDenyTypes: Deny list used when the configuration has no default rule set
+        :type defaultDenyTypes: [str]
+
+        :param ruleConfiguration: Parsed rule configuration (see the top of this file)
+        :type ruleConfiguration: dict
+        """
+        ruleConfiguration = ruleConfiguration or {}
+        defaultRules = ruleConfiguration.get("default", {"deny": defaultDenyTypes or []})
+        sectorRules = ruleConfiguration.get("sectors", {})
+        self.companyRules = {normaliseCompanyName(companyName): rules
+                             for companyName, rules in ruleConfiguration.get("companies", {}).items()}
+        self.companySectors = {normaliseCompanyName(companyName): sector
+                               for companyName, sector in ruleConfiguration.get("companySectors", {}).items()}
+
+        self.vocabulary = TypeVocabulary()
+        for rules in [defaultRules] + list(sectorRules.values()) + list(self.companyRules.values()):
+            for typeName in rules.get("deny", []) + rules.get("allow", []) + rules.get("require", []):
+                self.vocabulary.addType(typeName)
+
+        self.defaultDeny = set(defaultRules.get("deny", []))
+        self.defaultRequire = defaultRules.get("require", [])
+        self.defaultRuleSet = TypeRuleSet("default", self.vocabulary, self.defaultDeny, self.defaultRequire)
+
+        self.sectorDenies = {}
+        self.sectorRequires = {}
+        self.sectorRuleSets = {}
+        for sector, rules in sectorRules.items():
+            self.sectorDenies[sector] = self.getDenyTypes(rules, self.defaultDeny)
+            self.sectorRequires[sector] = rules.get("require", self.defaultRequire)
+            self.sectorRuleSets[sector] = TypeRuleSet("sector:" + sector, self.vocabulary, self.sectorDenies[sector],
+                                                      self.sectorRequires[sector])
+
+        # A company's rule set depends on the sector it inherits from, which may be the run's, so it is compiled on
+        # first use, once per (company, sector)
+        self.companyRuleSets = {}
+
+        LOGGER.debug("Type classifier compiled with %d types, %d sector and %d company rules",
+                     len(self.vocabulary.typeNames), len(self.sectorRuleSets), len(self.companyRules))
+
+    @staticmethod
+    def getDenyTypes(rules, inheritedDeny):
+        denyTypes = set(inheritedDeny) if rules.get("inheritDeny", True) else set()
+        denyTypes |= set(rules.get("deny", []))
+        denyTypes -= set(rules.get("allow", []))
+
+        return denyTypes
+
+    @classmethod
+    def fromJSONFile(cls, filename, defaultDenyTypes = None):
+        """
+        :param filename: Address of the rule configuration
+        :type filename: str
+
+        :param defaultDenyTypes: Deny list used when the configuration has no default rule set
+        :type defaultDenyTypes: [str]
+
+        :rtype: TypeClassifier
+        """
+        if filename is None:
+            LOGGER.error("filename is null")
+            raise TypeError
+
+        with open(filename, 'r') as file:
+            return cls(defaultDenyTypes = defaultDenyTypes, ruleConfiguration = json.load(file))
+
+    def getCompanyRuleSet(self, companyName, sector):
+        """
+        :param companyName: Normalised name of a company with rules of its own
+        :type companyName: str
+
+        :param sector: Sector whose deny and require lists the company inherits, or None for the default's
+        :type sector: str
+
+        :rtype: TypeRuleSet
+        """
+        if sector not in self.sectorRuleSets:
+            sector = None
+
+        ruleSet = self.companyRuleSets.get((companyName, sector))
+        if ruleSet is None:
+            rules = self.companyRules[companyName]
+            ruleSet = TypeRuleSet("company:" + companyName, self.vocabulary,
+                                  self.getDenyTypes(rules, self.sectorDenies.get(sector, self.defaultDeny)),
+                                  rules.get("require", self.sectorRequires.get(sector, self.defaultRequire)))
+            self.companyRuleSets[(companyName, sector)] = ruleSet
+
+        return ruleSet
+
+    def getRuleSet(self, companyName = None, sector = None):
+        """
+        :param companyName: Company whose rules should be applied
+        :type companyName: str
+
+        :param sector: Sector of the run, used for companies not listed in companySectors
+        :type sector: str
+
+        :return: The company's rule set, else its sector's, else the default one
+        :rtype: TypeRuleSet
+        """
+        if companyName is not None:
+            companyName = normaliseCompanyName(companyName)
+            sector = self.companySectors.get(companyName, sector)
+
+            if companyName in self.companyRules:
+                return self.getCompanyRuleSet(companyName, sector)
+
+        return self.sectorRuleSets.get(sector, self.defaultRuleSet)
+
+    def classifyBatch(self, typesBatch, companyName = None, sector = None):
+        """
+        Classifies the types of a whole batch of results (e.g. every result of one places_nearby() call) at once.
+
+        :param typesBatch: One list of type names per result
+        :type typesBatch: [[str]]
+
+        :param companyName: Company whose rules should be applied
+        :type companyName: str
+
+        :param sector: Sector of the run (see getRuleSet())
+        :type sector: str
+
+        :return: Whether each result is accepted, and a reason for each result
+        :rtype: (numpy.ndarray, [str])
+        """
+        return self.getRuleSet(companyName, sector).classifyMasks(self.vocabulary.encodeBatch(typesBatch))
+
+    def classify(self, types, companyName = None, sector = None):
+        """
+        :param types: Types of a single result
+        :type types: [str]
+
+        :param companyName: Company whose rules should be applied
+        :type companyName: str
+
+        :param sector: Sector of the run (see getRuleSet())
+        :type sector: str
+
+        :return: Whether the result is accepted, and why
+        :rtype: (bool, str)
+        """
+        isAccepted, reasons = self.classifyBatch([types], companyName, sector)
+
+        return bool(isAccepted[0]), reasons[0]
@@ -1,10 +1,16 @@
 # -*- coding: utf-8 -*-
+import sys
 import time
 import logging
 from pprint import pprint
 from ParseCitiesCSV import parseCitiesCSV
 from PySparkPreprocessing import getListOfCompanyNames
-from GooglePlacesSEB import getCompanyLocationsNearLocationList
+from GooglePlacesSEB import getCompanyLocationsNearLocationList, getCompanyLocationsBySweep, QUERY_STATISTICS, \
+    RADIUS_OF_SEARCH, MAX_PAGES_PER_SWEEP, PAGE_TOKEN_DELAY
+from CompanyLocationsParquet import writeCompanyLocationsParquet
+from RunProfiler import RunProfiler
+from RunPlanner import planCompanyLocationsRun, loadQueryStatistics, saveQueryStatistics
+from LoggingSetup import configureLogging
 
 """
 The following is a demonstration of the capabilities of the Google Places API when searching for locations of companies.
@@ -41,38 +47,95 @@ rather a proof-of-concept exploration of the API's free-tier capabilities and ho
         -- S. Romero Cruz, July 2019, S.E.B. New York
 """
 
-logging.basicConfig(level = logging.DEBUG, format = '%(asctime)s - %(levelname)s - %(message)s')
+# Logging runs on a background thread (see LoggingSetup.py). Set to logging.DEBUG to see fuzzy string non-matches
+LOGGING_LEVEL = logging.INFO
+LOG_AS_JSON = False
+configureLogging(level = LOGGING_LEVEL, jsonFormat = LOG_AS_JSON, force = True)
 LOGGER = logging.getLogger()
+SECTOR = "Materials"  # Also selects the sector's type rules, if the rule file has any (see TypeClassifier.py)
 COMPANY_NAME_SAMPLE_QUOTES = getListOfCompanyNames(fileName = "All_comp2019May.csv", sizeOfList = 20 , country = "USA",
-                                                   numberOfStopWordsToRemove = 0, sector ="Materials")
+                                                   numberOfStopWordsToRemove = 0, sector = SECTOR)
 
 CITY_AMOUNT_LIMIT = 20
+STATE = "New Jersey"
+
+# If set, every city is swept once per keyword and the results are matched against all companies at once, instead of
+# searching every company in every city (see getCompanyLocationsBySweep())
+USE_SWEEP_MODE = False
+SWEEP_KEYWORDS = ["materials", "cement", "chemical plant", "quarry"]
+
+# Set to None to skip the columnar (Parquet) copy of the results, see CompanyLocationsParquet.py
+PARQUET_OUTPUT_PATH = "sampleResults_tok80"
+
+# Profiling switches, see RunProfiler.py. All off by default
+PROFILE_OUTPUT_DIRECTORY = "profiles"
+ENABLE_CPROFILE = False
+ENABLE_TRACEMALLOC = False
+ENABLE_SAMPLING = False
+ENABLE_LOGGING_PROFILE = False
+
+# If DRY_RUN is set, only the execution plan is printed and no API call is made, see RunPlanner.py
+DRY_RUN = False
+# Per-company and sweep runs have different rates, so each mode keeps its own history
+QUERY_STATISTICS_HISTORY = "queryStatisticsSweep.jsonl" if USE_SWEEP_MODE else "queryStatistics.jsonl"
+DAILY_QUOTA = None
+DAILY_BUDGET = None
 
 # SOURCE:
 # https://public.opendatasoft.com/explore/dataset/1000-largest-us-cities-by-population-with-geographic-coordinates
 AMERICAN_CITIES = parseCitiesCSV(filename ="1000-largest-us-cities-by-population-with-geographic-coordinates.csv",
-                                 hasHeader = True, state = "New Jersey")
+                                 hasHeader = True, state = STATE)
 
 
 if __name__ == "__main__":
     print(COMPANY_NAME_SAMPLE_QUOTES)
+    executionPlan = planCompanyLocationsRun(companyNameList = COMPANY_NAME_SAMPLE_QUOTES,
+                                            locationsDictionary = AMERICAN_CITIES,
+                                            radiusFromEpicentre = RADIUS_OF_SEARCH,
+                                            limitOfAmountOfCities = CITY_AMOUNT_LIMIT,
+                                            historicalStatistics = loadQueryStatistics(QUERY_STATISTICS_HISTORY),
+                                            dailyQuota = DAILY_QUOTA, dailyBudget = DAILY_BUDGET,
+                                            sweepsPerCity = len(SWEEP_KEYWORDS) if USE_SWEEP_MODE else None,
+                                            pagesPerSweep = MAX_PAGES_PER_SWEEP, pageTokenDelay = PAGE_TOKEN_DELAY)
+    print(executionPlan)
+    if DRY_RUN:
+        sys.exit(0)
+
     startTime = time.time()
-    companyLocationsMaster = getCompanyLocationsNearLocationList(companyNameList = COMPANY_NAME_SAMPLE_QUOTES,
-                                                                 locationsDictionary = AMERICAN_CITIES,
-                                                                 limitOfAmountOfCities = CITY_AMOUNT_LIMIT)
-
-    print("\nResults for this sample: ")
-    with open("sampleResults_tok80.json", "w") as outputFile:
-        for companyName, companyQueryList in companyLocationsMaster.items():
-            if len(companyQueryList.getQueryResultList()) == 0:
-                LOGGER.info("0 RESULTS FOR: " + companyName.upper())
+    with RunProfiler(outputDirectory = PROFILE_OUTPUT_DIRECTORY, enableCProfile = ENABLE_CPROFILE,
+                     enableTracemalloc = ENABLE_TRACEMALLOC, enableSampling = ENABLE_SAMPLING,
+                     enableLoggingProfile = ENABLE_LOGGING_PROFILE) as runProfiler:
+        if USE_SWEEP_MODE:
+            companyLocationsMaster = getCompanyLocationsBySweep(companyNameList = COMPANY_NAME_SAMPLE_QUOTES,
+                                                                locationsDictionary = AMERICAN_CITIES,
+                                                                sweepKeywords = SWEEP_KEYWORDS,
+                                                                limitOfAmountOfCities = CITY_AMOUNT_LIMIT,
+                                                                profiler = runProfiler, sector = SECTOR)
+        else:
+            companyLocationsMaster = getCompanyLocationsNearLocationList(companyNameList = COMPANY_NAME_SAMPLE_QUOTES,
+                                                                         locationsDictionary = AMERICAN_CITIES,
+                                                                         limitOfAmountOfCities = CITY_AMOUNT_LIMIT,
+                                                                         profiler = runProfiler, sector = SECTOR)
+        runProfiler.markStage("queries")
+
+        print("\nResults for this sample: ")
+        with open("sampleResults_tok80.json", "w") as outputFile:
+            for companyName, companyQueryList in companyLocationsMaster.items():
+                if len(companyQueryList.getQueryResultList()) == 0:
+                    LOGGER.info("0 RESULTS FOR: %s", companyName.upper())
+                    print()
+                    continue
+
+                print(str(len(companyQueryList.getQueryResultList())) + " RESULTS FOR: " + companyName.upper())
+                pprint(companyQueryList.getDictionaryRepresentation())
+
+                print(companyQueryList.getDictionaryRepresentation(), file = outputFile, end = "\n")
                 print()
-                continue
 
-            print(str(len(companyQueryList.getQueryResultList())) + " RESULTS FOR: " + companyName.upper())
-            pprint(companyQueryList.getDictionaryRepresentation())
+        if PARQUET_OUTPUT_PATH:
+            writeCompanyLocationsParquet(companyLocationsMaster, PARQUET_OUTPUT_PATH, partitionBy = "companyName",
+                                         state = STATE, overwrite = True)
 
-            print(companyQueryList.getDictionaryRepresentation(), file = outputFile, end = "\n")
-            print()
+    saveQueryStatistics(QUERY_STATISTICS, QUERY_STATISTICS_HISTORY)
     print("--- %s seconds ---" % (time.time() - startTime))
 